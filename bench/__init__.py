@@ -0,0 +1,5 @@
+"""Benchmarks for the diff core, run with `python -m bench` from the package root.
+
+They run outside of Sublime: the core does not import `sublime`, and the
+options come from the defaults in SBSCompare.sublime-settings.
+"""
@@ -0,0 +1,182 @@
+"""Time `compute_diff` and `compute_intraline_differences` on generated inputs.
+
+    python -m bench                   # compare against bench/baseline.json
+    python -m bench --save-baseline   # record a new baseline
+    python -m bench -k minified --scale 0.1
+
+Times are the best of `--repeat` runs.  Peak memory is measured in a
+separate run under `tracemalloc`, which slows Python down a lot.  A
+scenario regresses if it takes more time or memory than the baseline
+plus `--tolerance`, or if its counts of regions or the degradations
+of its diff changed at all.
+"""
+from __future__ import annotations
+import argparse
+import gc
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+from typing import Any, Dict, List, Optional
+
+from core.budget import BUDGET_KEYS
+from core.cache import DIFF_KEYS, INTRALINE_KEYS
+from core.diff import Options, compute_diff, compute_intraline_differences
+from core.pieces import iter_pieces
+
+from .corpora import SCENARIOS, Scenario
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'baseline.json')
+SETTINGS = os.path.join(os.path.dirname(HERE), 'SBSCompare.sublime-settings')
+
+Measurement = Dict[str, Any]
+
+
+def default_options() -> Options:
+    """Return the diff options as the plugin reads them from its default settings."""
+    with open(SETTINGS, encoding='utf-8') as f:
+        text = f.read()
+    # The settings are JSON plus comments and trailing commas.  Drop whole
+    # line comments only, "//" also occurs within strings.
+    text = re.sub(r'^\s*//.*$', '', text, flags=re.M)
+    text = re.sub(r',(\s*[}\]])', r'\1', text)
+    settings = json.loads(text)
+    return {key: settings.get(key) for key in DIFF_KEYS + INTRALINE_KEYS + BUDGET_KEYS}
+
+
+# about a screenful
+FIRST_ROWS = 60
+
+
+def run(scenario: Scenario, options: Options, scale: float, repeat: int) -> Measurement:
+    a, b = scenario.build(scale)
+    options = {**options, **scenario.options}
+
+    diff_time = intraline_time = first_piece_time = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = compute_diff(a, b, options)
+        diff_time = min(diff_time, time.perf_counter() - start)
+        # what the views get drawn with first, see `sbs_compare.ViewFiller`
+        start = time.perf_counter()
+        next(iter_pieces(result, FIRST_ROWS, 1 << 16, 4000000))
+        first_piece_time = min(first_piece_time, time.perf_counter() - start)
+        start = time.perf_counter()
+        subA, subB = compute_intraline_differences(result.found_intraline_changes, options)
+        intraline_time = min(intraline_time, time.perf_counter() - start)
+
+    counts = {
+        'regionsA': len(result.regionsA),
+        'regionsB': len(result.regionsB),
+        'intraline_changes': len(result.found_intraline_changes),
+        'sub_highlights': len(subA) + len(subB),
+        'degraded': list(result.degraded),
+    }
+    del result, subA, subB
+    gc.collect()
+    # tracemalloc slows the diff down so much that it would run out of
+    # time where the timed runs did not, and then do different work.
+    traced_options = {**options, 'diff_time_limit': None}
+    tracemalloc.start()
+    try:
+        result = compute_diff(a, b, traced_options)
+        subA, subB = compute_intraline_differences(result.found_intraline_changes, traced_options)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'input_chars': len(a) + len(b),
+        'diff_seconds': round(diff_time, 4),
+        'intraline_seconds': round(intraline_time, 4),
+        'first_piece_seconds': round(first_piece_time, 6),
+        'peak_bytes': peak,
+        **counts,
+    }
+
+
+COUNTS = ('regionsA', 'regionsB', 'intraline_changes', 'sub_highlights', 'degraded')
+LIMITS = ('diff_seconds', 'intraline_seconds', 'first_piece_seconds', 'peak_bytes')
+# Times below this are too noisy to compare.
+MIN_SECONDS = 0.05
+
+
+def regressions(current: Measurement, baseline: Measurement, tolerance: float) -> List[str]:
+    found = []
+    for key in COUNTS:
+        if current[key] != baseline.get(key, current[key]):
+            found.append(f'{key} {baseline[key]} -> {current[key]}')
+    for key in LIMITS:
+        before = baseline.get(key)
+        if before is None or (key.endswith('seconds') and before < MIN_SECONDS):
+            continue
+        if current[key] > before * (1 + tolerance):
+            found.append(f'{key} {before} -> {current[key]} (+{current[key] / before - 1:.0%})')
+    return found
+
+
+def load_baseline(path: str, scale: float) -> Optional[Dict[str, Measurement]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('scale') != scale:
+        print(f'Baseline {path} was recorded with --scale {baseline.get("scale")}, ignoring it.')
+        return None
+    return baseline['scenarios']
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__.split('\n')[0])
+    parser.add_argument('-k', dest='only', help='run only the scenarios containing this')
+    parser.add_argument('--scale', type=float, default=1.0, help='grow or shrink the inputs')
+    parser.add_argument('--repeat', type=int, default=3, help='take the best of this many runs')
+    parser.add_argument('--algorithm', help='override the diff_algorithm setting')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed growth of times and memory, default 0.25')
+    parser.add_argument('--baseline', default=BASELINE, help='the baseline file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='record the results as the new baseline')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    options = default_options()
+    if args.algorithm:
+        options['diff_algorithm'] = args.algorithm
+    scenarios = [s for s in SCENARIOS if not args.only or args.only in s.name]
+    baseline = None if args.save_baseline else load_baseline(args.baseline, args.scale)
+
+    results: Dict[str, Measurement] = {}
+    failed = False
+    print(f"{'scenario':<20} {'diff s':>8} {'intra s':>8} {'1st ms':>7} {'peak MB':>8} "
+          f"{'regions':>15} {'sub-hl':>8}")
+    for scenario in scenarios:
+        m = results[scenario.name] = run(scenario, options, args.scale, args.repeat)
+        print(f"{scenario.name:<20} {m['diff_seconds']:>8.3f} {m['intraline_seconds']:>8.3f} "
+              f"{m['first_piece_seconds'] * 1000:>7.2f} {m['peak_bytes'] / 2**20:>8.1f} "
+              f"{m['regionsA']:>7}/{m['regionsB']:<7} {m['sub_highlights']:>8}")
+        for degradation in m['degraded']:
+            print(f'  degraded: {degradation}')
+        if baseline and scenario.name in baseline:
+            for problem in regressions(m, baseline[scenario.name], args.tolerance):
+                failed = True
+                print(f'  REGRESSION {problem}')
+
+    report = {'scale': args.scale, 'options': options, 'scenarios': results}
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Generated inputs for the benchmarks.
+
+Every corpus is built from a seeded random generator, so runs compare
+the very same texts.  `scale` shrinks or grows them.
+"""
+from __future__ import annotations
+import json
+import random
+
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+WORDS = (
+    'alpha beta gamma delta value result index count item node list map '
+    'key data buffer line offset size error state config user request'
+).split()
+
+
+class Scenario(NamedTuple):
+    name: str
+    description: str
+    build: Callable[[float], Tuple[str, str]]
+    # on top of the default options
+    options: Dict[str, object] = {}
+
+
+def _code_line(rnd: random.Random) -> str:
+    indent = '    ' * rnd.randint(0, 3)
+    words = rnd.sample(WORDS, rnd.randint(2, 6))
+    return f"{indent}{words[0]} = {'.'.join(words[1:])}({rnd.randint(0, 999)})"
+
+
+def _edit_lines(rnd: random.Random, lines: List[str], edits: int) -> List[str]:
+    lines = list(lines)
+    for _ in range(edits):
+        i = rnd.randrange(len(lines))
+        op = rnd.random()
+        if op < 0.4:
+            lines[i] = _code_line(rnd)
+        elif op < 0.7:
+            lines[i:i] = [_code_line(rnd) for _ in range(rnd.randint(1, 5))]
+        else:
+            del lines[i:i + rnd.randint(1, 5)]
+    return lines
+
+
+def large_few_edits(scale: float) -> Tuple[str, str]:
+    rnd = random.Random(1)
+    lines = [_code_line(rnd) for _ in range(int(200000 * scale))]
+    return '\n'.join(lines), '\n'.join(_edit_lines(rnd, lines, 20))
+
+
+def heavy_rewrite(scale: float) -> Tuple[str, str]:
+    rnd = random.Random(2)
+    lines = [_code_line(rnd) for _ in range(int(5000 * scale))]
+    rewritten = [
+        _code_line(rnd) if rnd.random() < 0.5 else line.replace('(', ' (', 1)
+        for line in lines
+    ]
+    return '\n'.join(lines), '\n'.join(_edit_lines(rnd, rewritten, len(lines) // 20))
+
+
+def minified(scale: float) -> Tuple[str, str]:
+    rnd = random.Random(3)
+    records = [
+        {'id': i, 'name': rnd.choice(WORDS), 'tags': rnd.sample(WORDS, 3), 'v': rnd.random()}
+        for i in range(int(20000 * scale))
+    ]
+    a = [json.dumps(records[i::4], separators=(',', ':')) for i in range(4)]
+    for _ in range(50):
+        record = rnd.choice(records)
+        record['name'] = rnd.choice(WORDS)
+    b = [json.dumps(records[i::4], separators=(',', ':')) for i in range(4)]
+    return '\n'.join(a), '\n'.join(b)
+
+
+def repetitive_logs(scale: float) -> Tuple[str, str]:
+    rnd = random.Random(4)
+    messages = [f'{level} {" ".join(rnd.sample(WORDS, 4))}' for level in
+                ('INFO', 'DEBUG', 'WARN') for _ in range(5)]
+    lines = [
+        f'2024-01-01 {i // 3600 % 24:02}:{i // 60 % 60:02}:{i % 60:02} {rnd.choice(messages)}'
+        for i in range(int(200000 * scale))
+    ]
+    other = [line for line in lines if rnd.random() > 0.01]
+    for _ in range(len(lines) // 200):
+        other.insert(rnd.randrange(len(other)), f'2024-01-01 00:00:00 ERROR {rnd.choice(WORDS)}')
+    return '\n'.join(lines), '\n'.join(other)
+
+
+def whitespace_only(scale: float) -> Tuple[str, str]:
+    rnd = random.Random(5)
+    lines = [_code_line(rnd) for _ in range(int(50000 * scale))]
+    other = [
+        line if rnd.random() < 0.9
+        else line.replace('    ', '\t') if rnd.random() < 0.5
+        else line.replace(' = ', '=')
+        for line in lines
+    ]
+    return '\n'.join(lines), '\n'.join(other)
+
+
+SCENARIOS = [
+    Scenario('large_few_edits', 'large file, 20 scattered edits', large_few_edits),
+    Scenario('heavy_rewrite', 'half of the lines rewritten', heavy_rewrite),
+    Scenario('minified', 'a few very long JSON lines', minified),
+    Scenario('repetitive_logs', 'log lines from a small vocabulary', repetitive_logs),
+    Scenario('whitespace_only', 'every tenth line reindented or reformatted', whitespace_only),
+    Scenario(
+        'whitespace_ignored', 'the same, with ignore_whitespace',
+        whitespace_only, {'ignore_whitespace': True}
+    ),
+]
@@ -0,0 +1,124 @@
+"""Row bookkeeping for editable comparisons.
+
+Both views of a comparison show the same rows: the lines of their side
+plus empty padding lines.  `Alignment` remembers which rows are padding
+and which are changed, follows the user's edits, and tells what to
+re-diff and how to patch the padding afterwards.
+"""
+from __future__ import annotations
+from array import array
+from itertools import compress
+
+from typing import Iterable, List, Tuple
+
+PADDING = 1
+CHANGED = 2
+
+# (row, number of padding rows to remove, number to insert)
+PaddingEdit = Tuple[int, int, int]
+
+_CHANGED_ONLY = bytes(1 if flag == CHANGED else 0 for flag in range(256))
+
+
+class Alignment:
+    """The `flags` of every row of both sides.
+
+    Rows above `top` and the last `bottom` rows of each side are aligned.
+    The rows in between are dirty, if `dirty` is set.
+    """
+    __slots__ = ('flags', 'top', 'bottom', 'dirty')
+
+    def __init__(self, rows: int, highlightA: Iterable[int], highlightB: Iterable[int]) -> None:
+        self.flags = (rows_flags(rows, highlightA, highlightB),
+                      rows_flags(rows, highlightB, highlightA))
+        self.top = self.bottom = 0
+        self.dirty = False
+
+    def edit(
+        self,
+        side: int,
+        first_row: int,
+        last_row: int,
+        rows: int,
+        keep_last: bool = False,
+        padding: bool = False
+    ) -> None:
+        """Rows `first_row` to `last_row` (inclusive) of `side` were replaced by `rows` rows.
+
+        The new rows are lines, or `padding`.  With `keep_last`, the last
+        of them is still the untouched old row, which stays what it was.
+        """
+        flags = self.flags[side]
+        tail = len(flags) - 1 - last_row
+        if self.dirty:
+            self.top = min(self.top, first_row)
+            self.bottom = min(self.bottom, tail)
+        else:
+            self.top, self.bottom, self.dirty = first_row, tail, True
+        new = bytearray([PADDING]) * rows if padding else bytearray(rows)
+        if keep_last:
+            new[-1] = flags[last_row]
+        flags[first_row:last_row + 1] = new
+
+    def window(self) -> Tuple[int, int, int]:
+        """Return the dirty rows, `(top, endA, endB)`, grown to the nearest equal rows."""
+        flagsA, flagsB = self.flags
+        top = self.top
+        while top > 0 and (flagsA[top - 1] or flagsB[top - 1]):
+            top -= 1
+        bottom = self.bottom
+        while bottom > 0 and (flagsA[-bottom] or flagsB[-bottom]):
+            bottom -= 1
+        return top, len(flagsA) - bottom, len(flagsB) - bottom
+
+    def replace(self, top: int, endA: int, endB: int, newA: bytes, newB: bytes) -> None:
+        """Replace the flags of the re-diffed rows, which are not dirty anymore."""
+        self.flags[0][top:endA] = newA
+        self.flags[1][top:endB] = newB
+        self.dirty = False
+
+    def changed_rows(self, side: int) -> array:
+        flags = self.flags[side]
+        return array('I', compress(range(len(flags)), flags.translate(_CHANGED_ONLY)))
+
+
+def rows_flags(rows: int, changed: Iterable[int], changed_other: Iterable[int]) -> bytearray:
+    """Return the flags of one side, padding being rows changed on the other side only."""
+    flags = bytearray(rows)
+    for row in changed:
+        flags[row] = CHANGED
+    for row in changed_other:
+        if not flags[row]:
+            flags[row] = PADDING
+    return flags
+
+
+def padding_edits(old: bytes, new: bytes) -> List[PaddingEdit]:
+    """Return the edits turning the padding of `old` rows into that of `new`.
+
+    Both must have the same lines, i.e. the same number of rows that
+    are not padding.  The edits are ordered bottom-up, so each can be
+    applied without shifting the rows of the ones still to come.
+    """
+    edits = []
+    gapsOld = _gaps(old)
+    gapsNew = _gaps(new)
+    for (row, count), (_, count_new) in zip(gapsOld, gapsNew):
+        if count > count_new:
+            edits.append((row, count - count_new, 0))
+        elif count < count_new:
+            edits.append((row, 0, count_new - count))
+    edits.reverse()
+    return edits
+
+
+def _gaps(flags: bytes) -> List[Tuple[int, int]]:
+    # (row, length) of the runs of padding before each line and at the end
+    gaps = []
+    start = 0
+    for row, flag in enumerate(flags):
+        if flag != PADDING:
+            gaps.append((start, row - start))
+            start = row + 1
+    gaps.append((start, len(flags) - start))
+    return gaps
@@ -0,0 +1,66 @@
+"""Limits keeping pathological inputs from diffing forever.
+
+A line diff steps down when it runs over its budget: from the fuzzy
+line pairing of ndiff to a plain line diff, then to matching only the
+lines unique on both sides.  Intraline diffs are dropped for the
+largest hunks.  All limits are options; `None` means no limit.
+"""
+from __future__ import annotations
+import time
+
+from typing import Optional
+
+BUDGET_KEYS = (
+    'diff_max_lines',
+    'diff_max_line_length',
+    'diff_max_fuzzy_pairs',
+    'diff_max_edits',
+    'diff_time_limit',
+    'intraline_max_chars',
+)
+
+# Fuzzy line pairing is skipped for inputs with more lines than this
+DEFAULT_MAX_LINES = 20000
+# or with lines longer than this.
+DEFAULT_MAX_LINE_LENGTH = 5000
+# Changed blocks are paired fuzzily if they have at most this many pairs
+# of lines.  Pairing takes up to cubic time and cannot be interrupted.
+DEFAULT_MAX_FUZZY_PAIRS = 10000
+# A plain line diff gives up after this many edits
+DEFAULT_MAX_EDITS = 10000
+# or after this many seconds.
+DEFAULT_TIME_LIMIT = 10.0
+# At most this many characters of changed lines are diffed intraline.
+DEFAULT_MAX_INTRALINE_CHARS = 10000000
+
+
+class BudgetExceeded(Exception):
+    """A diff ran over its `Budget`, the `reason` says how."""
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Budget:
+    """The limits of one attempt to diff two sequences of lines."""
+    __slots__ = ('max_edits', 'seconds', 'deadline', 'max_pairs')
+
+    def __init__(
+        self, max_edits: Optional[int], seconds: Optional[float], max_pairs: Optional[int] = None
+    ) -> None:
+        self.max_edits = max_edits
+        self.seconds = seconds
+        self.deadline = time.perf_counter() + seconds if seconds else None
+        self.max_pairs = max_pairs
+
+    def check(self, edits: int = 0) -> None:
+        """Raise `BudgetExceeded` if we need more than `edits` or ran out of time."""
+        if self.max_edits is not None and edits > self.max_edits:
+            raise BudgetExceeded(f"more than {self.max_edits} edits")
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise BudgetExceeded(f"over {self.seconds:g} seconds")
+
+    def check_pairs(self, pairs: int) -> None:
+        """Raise `BudgetExceeded` if we may not pair up `pairs` pairs of lines."""
+        if self.max_pairs is not None and pairs > self.max_pairs:
+            raise BudgetExceeded(f"changed blocks with more than {self.max_pairs} pairs of lines")
@@ -0,0 +1,156 @@
+"""A content-addressed LRU cache for diff and intraline results.
+
+Keys are digests of the inputs plus the options that affect the result,
+and the version of the wire format.
+Values are the results in their wire format, see `core.protocol`, so
+their size is easy to account for and they can go to disk as they are.
+"""
+from __future__ import annotations
+from array import array
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+from typing import Callable, Iterable, List, Optional, TypeVar, Union
+
+from . import protocol
+from .diff import IntralineChange, Options
+
+T = TypeVar('T')
+
+DIFF_KEYS = (
+    'ignore_pattern', 'ignore_whitespace', 'ignore_case', 'diff_algorithm', 'moved_min_lines'
+)
+INTRALINE_KEYS = (
+    'intraline_emptyspace',
+    'intraline_token_limit',
+    'intraline_line_limit',
+    'intraline_refine_limit',
+)
+
+
+def diff_key(view1_contents: str, view2_contents: str, options: Options) -> str:
+    return _digest(protocol.DIFF, options, DIFF_KEYS, [view1_contents, view2_contents])
+
+
+def intraline_key(changes: List[IntralineChange], options: Options) -> str:
+    return _digest(protocol.INTRALINE, options, INTRALINE_KEYS, [
+        array('I', [row for row, _, _ in changes]).tobytes(),
+        '\n'.join(left for _, left, _ in changes),
+        '\n'.join(right for _, _, right in changes),
+    ])
+
+
+def _digest(
+    kind: int, options: Options, keys: Iterable[str], fields: Iterable[Union[str, bytes]]
+) -> str:
+    effective = {key: options.get(key) for key in keys}
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(protocol.Writer().ints([protocol.FORMAT, kind]).json(effective).getvalue())
+    for field in fields:
+        data = field.encode('utf-8', 'surrogatepass') if isinstance(field, str) else field
+        digest.update(protocol.LENGTH.pack(len(data)))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Keep up to `max_size` bytes of results in memory.
+
+    With a `directory`, results are also written to disk, up to
+    `max_disk_size` bytes, and survive restarts.
+    """
+    def __init__(
+        self, max_size: int, directory: Optional[str] = None, max_disk_size: int = 0
+    ) -> None:
+        self.max_size = max_size
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def cached(
+        self,
+        key: str,
+        compute: Callable[[], T],
+        encode: Callable[[T], bytes],
+        decode: Callable[[bytes], T],
+        keep: Callable[[T], bool] = lambda result: True
+    ) -> T:
+        """Return the result under `key`, or `compute` it and remember it if we `keep` it."""
+        payload = self.get(key)
+        if payload is not None:
+            return decode(payload)
+        result = compute()
+        if keep(result):
+            self.put(key, encode(result))
+        return result
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            payload = self.entries.get(key)
+            if payload is not None:
+                self.entries.move_to_end(key)
+                return payload
+
+        if not self.directory:
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        self._remember(key, payload)
+        return payload
+
+    def put(self, key: str, payload: bytes) -> None:
+        self._remember(key, payload)
+        if self.directory:
+            try:
+                self._write(key, payload)
+            except OSError as e:
+                print(f"Compare Error: could not write to the result cache.\n{e}")
+
+    def _remember(self, key: str, payload: bytes) -> None:
+        if len(payload) > self.max_size:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = payload
+            self.size += len(payload)
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def _write(self, key: str, payload: bytes) -> None:
+        assert self.directory
+        if len(payload) > self.max_disk_size:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key)
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+
+        # Evict the least recently used files, `get` touches them.
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,141 @@
+"""Collapse the unchanged rows of a comparison down to some context.
+
+Long runs of rows equal on both sides are replaced by one placeholder
+row each.  The full buffers are kept, so that the collapsed rows can be
+brought back when the user wants to see them.
+"""
+from __future__ import annotations
+from array import array
+from bisect import bisect_right
+from itertools import chain
+
+from typing import List, Optional, Tuple
+
+from .diff import DiffResult, Span
+from .hunks import HunkIndex
+from .lines import LineIndex
+
+PLACEHOLDER = '⋯ {} unchanged lines ⋯'
+
+
+class RowIndex:
+    """The rows of a buffer, i.e. its lines including an empty last one."""
+    __slots__ = ('text', 'starts')
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.starts = LineIndex(text).starts
+        if not text or text.endswith('\n'):
+            self.starts.append(len(text))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def end(self, row: int) -> int:
+        """Return the offset of the end of `row`, excluding its newline."""
+        return self.starts[row + 1] - 1 if row + 1 < len(self.starts) else len(self.text)
+
+    def span(self, first: int, end: int) -> str:
+        """Return the rows `first` to `end` (exclusive) joined by newlines."""
+        return self.text[self.starts[first]:self.end(end - 1)]
+
+
+class Folds:
+    """The collapsed rows of a comparison, in rows of the full buffers.
+
+    `rows` are the rows of the placeholders in the collapsed buffers.
+    """
+    __slots__ = ('sources', 'spans', 'rows')
+
+    def __init__(self, bufferA: str, bufferB: str) -> None:
+        self.sources = (RowIndex(bufferA), RowIndex(bufferB))
+        self.spans: List[Span] = []
+        self.rows: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def expand(self, n: int) -> Tuple[str, str]:
+        """Forget the `n`th fold, return its rows for both sides."""
+        first, end = self.spans.pop(n)
+        sourceA, sourceB = self.sources
+        return sourceA.span(first, end), sourceB.span(first, end)
+
+
+class Shifts:
+    """Map positions, rows or offsets, to where they are after edits.
+
+    Positions at or after the `k`th bound move by the `k`th delta.
+    Bounds must be added in ascending order.
+    """
+    __slots__ = ('bounds', 'deltas')
+
+    def __init__(self) -> None:
+        self.bounds = array('I')
+        self.deltas = array('q')
+
+    def add(self, bound: int, delta: int) -> None:
+        self.bounds.append(bound)
+        self.deltas.append((self.deltas[-1] if self.deltas else 0) + delta)
+
+    def __call__(self, pos: int) -> int:
+        k = bisect_right(self.bounds, pos)
+        return pos + self.deltas[k - 1] if k else pos
+
+
+def collapse(result: DiffResult, context: int) -> Tuple[DiffResult, Optional[Folds]]:
+    """Collapse the rows further away than `context` rows from any change.
+
+    Return the collapsed result and its folds, or the very `result` and
+    None if there is nothing worth collapsing.
+    """
+    folds = Folds(result.bufferA, result.bufferB)
+    total = len(folds.sources[0])
+    hunks = HunkIndex.from_rows(result.highlightA, result.highlightB)
+    equal_start = 0
+    for start, end in chain(zip(hunks.starts, hunks.ends), [(total, total)]):
+        first = equal_start + context if equal_start else 0
+        last = start - context if start < total else total
+        # A placeholder for a single row would not save anything.
+        if last - first > 1:
+            folds.spans.append((first, last))
+        equal_start = end
+    if not folds.spans:
+        return result, None
+
+    rows = Shifts()
+    for first, end in folds.spans:
+        folds.rows.append(rows(first))
+        rows.add(end, first + 1 - end)
+
+    bufferA, offsetsA = _collapse_buffer(folds.sources[0], folds.spans)
+    bufferB, offsetsB = _collapse_buffer(folds.sources[1], folds.spans)
+    return DiffResult(
+        bufferA, bufferB,
+        array('I', map(rows, result.highlightA)),
+        array('I', map(rows, result.highlightB)),
+        [(rows(row), left, right) for row, left, right in result.found_intraline_changes],
+        [(offsetsA(a), offsetsA(b)) for a, b in result.regionsA],
+        [(offsetsB(a), offsetsB(b)) for a, b in result.regionsB],
+        array('I', map(offsetsA, result.intraline_offsetsA)),
+        array('I', map(offsetsB, result.intraline_offsetsB)),
+        result.degraded,
+        [(offsetsA(a), offsetsA(b)) for a, b in result.movedA],
+        [(offsetsB(a), offsetsB(b)) for a, b in result.movedB],
+    ), folds
+
+
+def _collapse_buffer(source: RowIndex, spans: List[Span]) -> Tuple[str, Shifts]:
+    text = source.text
+    parts = []
+    offsets = Shifts()
+    pos = 0
+    for first, end in spans:
+        begin, stop = source.starts[first], source.end(end - 1)
+        placeholder = PLACEHOLDER.format(end - first)
+        parts.append(text[pos:begin])
+        parts.append(placeholder)
+        offsets.add(stop, len(placeholder) - (stop - begin))
+        pos = stop
+    parts.append(text[pos:])
+    return ''.join(parts), offsets
@@ -0,0 +1,437 @@
+"""The diff core: line diff plus intraline diff.
+
+This module must not import `sublime`; it also runs in the worker
+processes, see `core.pool`.
+"""
+from __future__ import annotations
+from array import array
+from functools import lru_cache, partial
+from itertools import compress
+import re
+
+from typing import (
+    TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence,
+    Tuple, Union
+)
+
+from .budget import (
+    DEFAULT_MAX_EDITS, DEFAULT_MAX_FUZZY_PAIRS, DEFAULT_MAX_INTRALINE_CHARS,
+    DEFAULT_MAX_LINE_LENGTH, DEFAULT_MAX_LINES, DEFAULT_TIME_LIMIT, Budget, BudgetExceeded
+)
+from .engines import ANCHOR_ENGINE, DEFAULT_ENGINE, TEXT_ENGINES, Opcode, get_opcodes
+from .intraline import diff_line
+from .lines import LineIndex, intern_lines
+from .metrics import Metrics, maybe_phase
+from .moves import DEFAULT_MIN_LINES, find_moves
+
+if TYPE_CHECKING:
+    from .pieces import PieceStream
+
+Options = Dict[str, Any]
+IntralineChange = Tuple[int, str, str]
+SubHighlight = Tuple[int, int, int]
+Span = Tuple[int, int]
+# a changed block: its opcode, its first row, and its offsets in the buffers
+Hunk = Tuple[Opcode, int, int, int]
+
+
+class DiffResult(NamedTuple):
+    bufferA: str
+    bufferB: str
+    # the changed rows
+    highlightA: array
+    highlightB: array
+    found_intraline_changes: List[IntralineChange]
+    # the changed blocks of lines as offsets into the buffers
+    regionsA: List[Span]
+    regionsB: List[Span]
+    # for each of the `found_intraline_changes`, the offsets of its row
+    intraline_offsetsA: array
+    intraline_offsetsB: array
+    # how the diff stepped down to stay within its budget, see `core.budget`
+    degraded: Tuple[str, ...] = ()
+    # the blocks of lines moved elsewhere, highlighted instead of `regionsA`
+    # and `regionsB`, see `core.moves`
+    movedA: Sequence[Span] = ()
+    movedB: Sequence[Span] = ()
+
+
+class BufferBuilder:
+    """Collect runs of lines for a buffer, tracking their offsets."""
+    __slots__ = ('parts', 'size')
+
+    def __init__(self) -> None:
+        self.parts: List[str] = []
+        self.size = 0
+
+    def append(self, lines: str) -> int:
+        """Append `lines`, which must not end with a newline, return their offset."""
+        if self.parts:
+            self.size += 1
+        offset = self.size
+        self.parts.append(lines)
+        self.size += len(lines)
+        return offset
+
+    def getvalue(self) -> str:
+        return '\n'.join(self.parts)
+
+
+class LineNormalizer:
+    """The ignore_* options fused into one substitution (plus lowercasing).
+
+    `normalize` applies all of them to a line in a single pass.
+    """
+    __slots__ = ('normalize',)
+
+    def __init__(self, ignore_pattern: str, ignore_whitespace: bool, ignore_case: bool) -> None:
+        # Both alternatives only ever remove text, and the user's pattern
+        # is tried first at every position, just as if we ran it before
+        # stripping the whitespace.
+        alternatives = []
+        if ignore_pattern:
+            alternatives.append(f'(?:{ignore_pattern})')
+        if ignore_whitespace:
+            alternatives.append(r'[ \t]')
+
+        normalize: Callable[[str], str]
+        if alternatives:
+            sub = partial(re.compile('|'.join(alternatives), re.MULTILINE).sub, '')
+            normalize = (lambda line: sub(line).lower()) if ignore_case else sub
+        else:
+            normalize = str.lower
+        self.normalize = normalize
+
+    def memo(self) -> Dict[str, str]:
+        """Return a cache to normalize each distinct line only once."""
+        return _Memo(self.normalize)
+
+
+class _Memo(dict):
+    __slots__ = ('normalize',)
+
+    def __init__(self, normalize: Callable[[str], str]) -> None:
+        self.normalize = normalize
+
+    def __missing__(self, line: str) -> str:
+        value = self[line] = self.normalize(line)
+        return value
+
+
+def line_normalizer(options: Options) -> Optional[LineNormalizer]:
+    """Return the normalizer for the ignore_* options, if any."""
+    key = (
+        options.get('ignore_pattern') or '',
+        bool(options.get('ignore_whitespace', False)),
+        bool(options.get('ignore_case', False)),
+    )
+    if not any(key):
+        return None
+    return _line_normalizer(*key)
+
+
+# The options rarely change, so we only keep the latest normalizer.
+@lru_cache(maxsize=1)
+def _line_normalizer(
+    ignore_pattern: str, ignore_whitespace: bool, ignore_case: bool
+) -> LineNormalizer:
+    return LineNormalizer(ignore_pattern, ignore_whitespace, ignore_case)
+
+
+def compute_diff(
+    view1_contents: str,
+    view2_contents: str,
+    options: Options,
+    on_progress: Optional[Callable[[float], None]] = None,
+    metrics: Optional[Metrics] = None,
+    stream: Optional[PieceStream] = None
+) -> DiffResult:
+    # `on_progress` is called with the fraction of work done so far.  It
+    # may raise to abort the computation.  `metrics` get the timings of
+    # the phases.  The `stream` gets the buffers while they are assembled.
+    if on_progress is None:
+        on_progress = lambda progress: None
+
+    # We never copy the lines of the inputs.  The indexes point into them,
+    # and the differ only sees (interned) normalized lines.
+    with maybe_phase(metrics, 'diff.lines') as record:
+        indexA = LineIndex(view1_contents)
+        indexB = LineIndex(view2_contents)
+        diffLinesA: Iterable[str] = indexA
+        diffLinesB: Iterable[str] = indexB
+        normalized: Dict[str, str] = {}
+        normalizer = line_normalizer(options)
+        if normalizer:
+            # Shared by both sides, most lines are common to them.
+            normalized = normalizer.memo()
+            diffLinesA = map(normalized.__getitem__, indexA)
+            diffLinesB = map(normalized.__getitem__, indexB)
+
+        algorithm = options.get('diff_algorithm', DEFAULT_ENGINE)
+        degraded: List[str] = []
+        if algorithm in TEXT_ENGINES and (reason := _fuzzy_over_budget(indexA, indexB, options)):
+            degraded.append(f"plain line diff instead of {algorithm} ({reason})")
+            algorithm = DEFAULT_ENGINE
+        seqA: Sequence
+        seqB: Sequence
+        if algorithm in TEXT_ENGINES:
+            seqA, seqB = list(diffLinesA), list(diffLinesB)
+        else:
+            seqA, seqB = intern_lines(diffLinesA, diffLinesB)
+        normalized.clear()
+        record.update(linesA=len(indexA), linesB=len(indexB))
+
+    # Step down whenever we run over the budget.  Matching unique lines
+    # only always finishes in time.
+    min_moved = options.get('moved_min_lines', DEFAULT_MIN_LINES)
+    while True:
+        budget = None if algorithm == ANCHOR_ENGINE else Budget(
+            options.get('diff_max_edits', DEFAULT_MAX_EDITS),
+            options.get('diff_time_limit', DEFAULT_TIME_LIMIT),
+            options.get('diff_max_fuzzy_pairs', DEFAULT_MAX_FUZZY_PAIRS),
+        )
+        try:
+            opcodes = get_opcodes(seqA, seqB, algorithm, budget)
+            hunks: Optional[List[Hunk]] = [] if min_moved else None
+            result = _assemble(indexA, indexB, opcodes, on_progress, metrics, hunks, stream)
+            break
+        except BudgetExceeded as e:
+            if algorithm in TEXT_ENGINES:
+                degraded.append(f"plain line diff instead of {algorithm} ({e.reason})")
+                algorithm = DEFAULT_ENGINE
+                seqA, seqB = intern_lines(seqA, seqB)
+            else:
+                degraded.append(f"matched unique lines only ({e.reason})")
+                algorithm = ANCHOR_ENGINE
+
+    if hunks is not None:
+        # Moves can be anywhere, so we need the whole diff first.  They
+        # don't change the layout, just the highlighting.
+        with maybe_phase(metrics, 'diff.moves') as record:
+            moved = find_moves(seqA, seqB, (opcode for opcode, *_ in hunks), min_moved, indexA)
+            movedA, movedB = moved[0].count(1), moved[1].count(1)
+            record.update(movedA=movedA, movedB=movedB)
+            if movedA or movedB:
+                result = _apply_moves(result, indexA, indexB, hunks, moved)
+                record.update(movesA=len(result.movedA), movesB=len(result.movedB))
+
+    max_chars = options.get('intraline_max_chars', DEFAULT_MAX_INTRALINE_CHARS)
+    if max_chars is not None:
+        result, dropped = _drop_largest_intraline_hunks(result, max_chars)
+        if dropped:
+            degraded.append(
+                f"no intraline diff for the {dropped} largest hunks "
+                f"(more than {max_chars} characters)"
+            )
+    return result._replace(degraded=tuple(degraded))
+
+
+def _fuzzy_over_budget(indexA: LineIndex, indexB: LineIndex, options: Options) -> str:
+    max_lines = options.get('diff_max_lines', DEFAULT_MAX_LINES)
+    if max_lines is not None and max(len(indexA), len(indexB)) > max_lines:
+        return f"more than {max_lines} lines"
+    max_length = options.get('diff_max_line_length', DEFAULT_MAX_LINE_LENGTH)
+    if max_length is not None and any(
+        len(line) > max_length for index in (indexA, indexB) for line in index
+    ):
+        return f"lines longer than {max_length} characters"
+    return ''
+
+
+def _reporting(
+    opcodes: Iterable[Opcode], total: int, on_progress: Callable[[float], None]
+) -> Iterator[Opcode]:
+    on_progress(0.0)
+    for opcode in opcodes:
+        on_progress(opcode[2] / (total or 1))
+        yield opcode
+
+
+def _assemble(
+    indexA: LineIndex,
+    indexB: LineIndex,
+    opcodes: Iterable[Opcode],
+    on_progress: Optional[Callable[[float], None]],
+    metrics: Optional[Metrics],
+    hunks: Optional[List[Hunk]] = None,
+    stream: Optional[PieceStream] = None
+) -> DiffResult:
+    # The changed blocks are collected in `hunks`, and the `stream` gets
+    # the buffers after every opcode.
+    if on_progress:
+        opcodes = _reporting(opcodes, len(indexA), on_progress)
+    if stream:
+        stream.start()
+
+    # The buffers are assembled from whole runs of lines, each run being one
+    # slice of the input, plus runs of padding lines.
+    bufferA = BufferBuilder()
+    bufferB = BufferBuilder()
+    row = 0
+
+    highlightA = array('I')
+    highlightB = array('I')
+    regionsA: List[Span] = []
+    regionsB: List[Span] = []
+    intraline_offsetsA = array('I')
+    intraline_offsetsB = array('I')
+
+    # Within a "replace" hunk the changed lines are paired row by row; these
+    # pairs are the candidates for the intraline diff.  The shorter side of
+    # the hunk gets padded with empty lines so that both buffers line up.
+    found_intraline_changes: List[IntralineChange] = []
+    with maybe_phase(metrics, 'diff.opcodes') as record:
+        if metrics:
+            # the time spent in the engine, the rest is building the buffers
+            opcodes = metrics.timed(record, 'match_seconds', opcodes)
+        for tag, i1, i2, j1, j2 in opcodes:
+            n, m = i2 - i1, j2 - j1
+            if tag == 'equal':
+                bufferA.append(indexA.span(i1, i2))
+                bufferB.append(indexB.span(j1, j2))
+                row += n
+            else:
+                offsetA = offsetB = 0
+                if n:
+                    offsetA = bufferA.append(indexA.span(i1, i2))
+                    regionsA.append((offsetA, bufferA.size))
+                    highlightA.extend(range(row, row + n))
+                if m:
+                    offsetB = bufferB.append(indexB.span(j1, j2))
+                    regionsB.append((offsetB, bufferB.size))
+                    highlightB.extend(range(row, row + m))
+                if hunks is not None:
+                    hunks.append(((tag, i1, i2, j1, j2), row, offsetA, offsetB))
+                for r in range(min(n, m)):
+                    found_intraline_changes.append(
+                        (row + r, indexA.line(i1 + r), indexB.line(j1 + r))
+                    )
+                    intraline_offsetsA.append(offsetA + indexA.starts[i1 + r] - indexA.starts[i1])
+                    intraline_offsetsB.append(offsetB + indexB.starts[j1 + r] - indexB.starts[j1])
+                if n < m:
+                    bufferA.append('\n' * (m - n - 1))
+                elif m < n:
+                    bufferB.append('\n' * (n - m - 1))
+                row += max(n, m)
+            if stream:
+                stream.feed(row, bufferA, bufferB, regionsA, regionsB)
+        if stream:
+            stream.feed(row, bufferA, bufferB, regionsA, regionsB, last=True)
+        record.update(regionsA=len(regionsA), regionsB=len(regionsB))
+
+    with maybe_phase(metrics, 'diff.join'):
+        joinedA, joinedB = bufferA.getvalue(), bufferB.getvalue()
+    return DiffResult(
+        joinedA, joinedB,
+        highlightA, highlightB, found_intraline_changes,
+        regionsA, regionsB, intraline_offsetsA, intraline_offsetsB,
+        movedA=[], movedB=[]
+    )
+
+
+def _apply_moves(
+    result: DiffResult,
+    indexA: LineIndex,
+    indexB: LineIndex,
+    hunks: List[Hunk],
+    moved: Tuple[bytearray, bytearray]
+) -> DiffResult:
+    """Highlight the `moved` lines of the `hunks` as such, instead of as changed.
+
+    Moved lines are not changed, they are just elsewhere, so they are not
+    diffed intraline either.
+    """
+    movedRowsA, movedRowsB = moved
+    regionsA: List[Span] = []
+    regionsB: List[Span] = []
+    movedA: List[Span] = []
+    movedB: List[Span] = []
+    unpaired = set()
+    for (_, i1, i2, j1, j2), row, offsetA, offsetB in hunks:
+        if i1 < i2:
+            _split_moved(indexA, i1, i2, offsetA, movedRowsA, regionsA, movedA)
+        if j1 < j2:
+            _split_moved(indexB, j1, j2, offsetB, movedRowsB, regionsB, movedB)
+        for r in range(min(i2 - i1, j2 - j1)):
+            if movedRowsA[i1 + r] or movedRowsB[j1 + r]:
+                unpaired.add(row + r)
+    changes = result.found_intraline_changes
+    keep = [row not in unpaired for row, _, _ in changes]
+    return result._replace(
+        regionsA=regionsA, regionsB=regionsB, movedA=movedA, movedB=movedB,
+        found_intraline_changes=list(compress(changes, keep)),
+        intraline_offsetsA=array('I', compress(result.intraline_offsetsA, keep)),
+        intraline_offsetsB=array('I', compress(result.intraline_offsetsB, keep)),
+    )
+
+
+def _split_moved(
+    index: LineIndex, i1: int, i2: int, offset: int, moved: Union[bytes, bytearray],
+    regions: List[Span], moves: List[Span]
+) -> None:
+    """Add the spans of the lines `i1` to `i2` at `offset` to `regions` or `moves`."""
+    start = index.starts[i1]
+    i = i1
+    while i < i2:
+        flag = moved[i]
+        k = i + 1
+        while k < i2 and moved[k] == flag:
+            k += 1
+        (moves if flag else regions).append(
+            (offset + index.starts[i] - start, offset + index.end(k - 1) - start)
+        )
+        i = k
+
+
+def _drop_largest_intraline_hunks(result: DiffResult, max_chars: int) -> Tuple[DiffResult, int]:
+    """Drop the intraline changes of the largest hunks until `max_chars` are left.
+
+    Return the new result and the number of hunks dropped.
+    """
+    changes = result.found_intraline_changes
+    sizes = [len(left) + len(right) for _, left, right in changes]
+    total = sum(sizes)
+    if total <= max_chars:
+        return result, 0
+
+    # The paired rows of a hunk are consecutive.
+    hunks = []
+    start = 0
+    for k in range(1, len(changes) + 1):
+        if k == len(changes) or changes[k][0] != changes[k - 1][0] + 1:
+            hunks.append((sum(sizes[start:k]), start, k))
+            start = k
+    keep = bytearray([1]) * len(changes)
+    dropped = 0
+    for chars, start, end in sorted(hunks, reverse=True):
+        if total <= max_chars:
+            break
+        keep[start:end] = bytes(end - start)
+        total -= chars
+        dropped += 1
+    return result._replace(
+        found_intraline_changes=list(compress(changes, keep)),
+        intraline_offsetsA=array('I', compress(result.intraline_offsetsA, keep)),
+        intraline_offsetsB=array('I', compress(result.intraline_offsetsB, keep)),
+    ), dropped
+
+
+def compute_intraline_differences(
+    found_intraline_changes: List[IntralineChange],
+    options: Options
+) -> Tuple[List[SubHighlight], List[SubHighlight]]:
+    intraline_emptyspace = options.get('intraline_emptyspace', False)
+    subHighlightA: List[SubHighlight] = []
+    subHighlightB: List[SubHighlight] = []
+    for line_num, left, right in found_intraline_changes:
+        for tag, i1, i2, j1, j2 in diff_line(left, right, options):
+            if intraline_emptyspace:
+                if tag == 'insert':
+                    i2 += j2 - j1
+                if tag == 'delete':
+                    j2 += i2 - i1
+
+            subHighlightA.append((line_num, i1, i2))
+            subHighlightB.append((line_num, j1, j2))
+
+    return subHighlightA, subHighlightB
@@ -0,0 +1,480 @@
+"""Line diff engines.
+
+Every engine takes two sequences of hashable, comparable items (usually
+lines) and returns opcodes in the format of `difflib.SequenceMatcher`,
+i.e. `(tag, i1, i2, j1, j2)` tuples in order.  Consumers pair the lines
+of a "replace" opcode row by row.
+
+Engines may also take a `budget` keyword, and raise `BudgetExceeded`
+when they run over it.
+"""
+from __future__ import annotations
+from bisect import bisect_left
+import difflib
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .budget import Budget
+
+Opcode = Tuple[str, int, int, int, int]
+Match = Tuple[int, int, int]
+Engine = Callable[..., Iterable[Opcode]]
+
+DEFAULT_ENGINE = 'myers'
+# The last resort for inputs too costly to diff properly.
+ANCHOR_ENGINE = 'anchors'
+# Engines which look at the text of the lines, not just at their identity.
+# They can't work on interned lines.
+TEXT_ENGINES = {'ndiff'}
+# The histogram engine ignores lines occurring more often than this and
+# falls back to Myers if only such lines are left.
+MAX_CHAIN_LENGTH = 64
+
+
+def get_opcodes(
+    a: Sequence, b: Sequence, algorithm: str = DEFAULT_ENGINE, budget: Optional[Budget] = None
+) -> Iterator[Opcode]:
+    try:
+        engine = ENGINES[algorithm]
+    except KeyError:
+        print(f"Compare Error: unknown diff_algorithm {algorithm!r}, using {DEFAULT_ENGINE!r}")
+        engine = ENGINES[DEFAULT_ENGINE]
+
+    # Typically only a small middle part differs.  Strip the common head
+    # and tail so that the engine only sees that part.
+    la, lb = len(a), len(b)
+    prefix, suffix = _trim(a, 0, la, b, 0, lb)
+    if prefix:
+        yield ('equal', 0, prefix, 0, prefix)
+    if prefix < la - suffix or prefix < lb - suffix:
+        a, b = a[prefix:la - suffix], b[prefix:lb - suffix]
+        middle = engine(a, b, budget=budget) if budget else engine(a, b)
+        for tag, i1, i2, j1, j2 in middle:
+            yield (tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+    if suffix:
+        yield ('equal', la - suffix, la, lb - suffix, lb)
+
+
+def register_engine(name: str, engine: Engine) -> None:
+    ENGINES[name] = engine
+
+
+def opcodes_from_matches(matches: Iterable[Match], la: int, lb: int) -> Iterator[Opcode]:
+    """Turn ordered matching blocks `(i, j, n)` into opcodes."""
+    i = j = 0
+    for ai, bj, n in chain_adjacent(matches):
+        tag = ''
+        if i < ai and j < bj:
+            tag = 'replace'
+        elif i < ai:
+            tag = 'delete'
+        elif j < bj:
+            tag = 'insert'
+        if tag:
+            yield (tag, i, ai, j, bj)
+        if n:
+            yield ('equal', ai, ai + n, bj, bj + n)
+        i, j = ai + n, bj + n
+    if i < la and j < lb:
+        yield ('replace', i, la, j, lb)
+    elif i < la:
+        yield ('delete', i, la, j, lb)
+    elif j < lb:
+        yield ('insert', i, la, j, lb)
+
+
+def chain_adjacent(matches: Iterable[Match]) -> Iterator[Match]:
+    """Merge touching matching blocks and drop empty ones."""
+    ci = cj = cn = 0
+    for i, j, n in matches:
+        if not n:
+            continue
+        if ci + cn == i and cj + cn == j:
+            cn += n
+        else:
+            if cn:
+                yield (ci, cj, cn)
+            ci, cj, cn = i, j, n
+    if cn:
+        yield (ci, cj, cn)
+
+
+def _trim(a, alo, ahi, b, blo, bhi):
+    """Return the lengths of the common prefix and suffix of both ranges."""
+    prefix = 0
+    limit = min(ahi - alo, bhi - blo)
+    while prefix < limit and a[alo + prefix] == b[blo + prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and a[ahi - 1 - suffix] == b[bhi - 1 - suffix]:
+        suffix += 1
+    return prefix, suffix
+
+
+# Work items on the explicit stacks below.  We don't recurse in Python
+# to not hit the recursion limit on degenerated input.
+_RANGE, _MATCH = 0, 1
+
+
+def _middle_snake(a, alo, ahi, b, blo, bhi, budget=None):
+    """Find the middle snake of the shortest edit script.
+
+    Returns `(x, y, u, v)` relative to `alo`/`blo`, the snake running
+    from `(x, y)` to `(u, v)`.  The ranges must neither be empty nor
+    start or end with equal items.
+    """
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    odd = delta & 1
+    max_d = (n + m + 1) // 2
+    offset = max_d + 1
+    vf = [0] * (2 * max_d + 3)
+    vb = [0] * (2 * max_d + 3)
+    for d in range(max_d + 1):
+        if budget:
+            # Both searches took `d` edits so far.
+            budget.check(2 * d)
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[offset + k - 1] < vf[offset + k + 1]):
+                x = vf[offset + k + 1]
+            else:
+                x = vf[offset + k - 1] + 1
+            y = x - k
+            sx, sy = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            vf[offset + k] = x
+            kr = delta - k
+            if odd and -d < kr < d and x + vb[offset + kr] >= n:
+                return sx, sy, x, y
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vb[offset + k - 1] < vb[offset + k + 1]):
+                x = vb[offset + k + 1]
+            else:
+                x = vb[offset + k - 1] + 1
+            y = x - k
+            sx, sy = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            vb[offset + k] = x
+            kf = delta - k
+            if not odd and -d <= kf <= d and x + vf[offset + kf] >= n:
+                return n - x, m - y, n - sx, m - sy
+    raise AssertionError('unreachable: no middle snake found')
+
+
+def myers_matches(
+    a: Sequence,
+    b: Sequence,
+    alo: int = 0,
+    ahi: int = -1,
+    blo: int = 0,
+    bhi: int = -1,
+    budget: Optional[Budget] = None
+) -> Iterator[Match]:
+    """Yield the matching blocks of the O(ND) difference algorithm.
+
+    This is the linear space variant of Myers' algorithm, which splits
+    the problem at the middle snake of the edit script.
+    """
+    if ahi < 0:
+        ahi = len(a)
+    if bhi < 0:
+        bhi = len(b)
+    stack: List[tuple] = [(_RANGE, alo, ahi, blo, bhi)]
+    while stack:
+        item = stack.pop()
+        if item[0] == _MATCH:
+            yield item[1:]
+            continue
+        _, alo, ahi, blo, bhi = item
+        if budget:
+            budget.check()
+        prefix, suffix = _trim(a, alo, ahi, b, blo, bhi)
+        if prefix:
+            yield (alo, blo, prefix)
+        if suffix:
+            stack.append((_MATCH, ahi - suffix, bhi - suffix, suffix))
+        alo += prefix
+        blo += prefix
+        ahi -= suffix
+        bhi -= suffix
+        if alo == ahi or blo == bhi:
+            continue
+        x, y, u, v = _middle_snake(a, alo, ahi, b, blo, bhi, budget)
+        stack.append((_RANGE, alo + u, ahi, blo + v, bhi))
+        if u > x:
+            stack.append((_MATCH, alo + x, blo + y, u - x))
+        stack.append((_RANGE, alo, alo + x, blo, blo + y))
+
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi) -> List[Tuple[int, int]]:
+    """Return the longest increasing run of lines unique in both ranges."""
+    in_a: Dict[object, int] = {}
+    for i in range(alo, ahi):
+        line = a[i]
+        in_a[line] = -1 if line in in_a else i
+    in_b: Dict[object, int] = {}
+    for j in range(blo, bhi):
+        line = b[j]
+        if in_a.get(line, -1) >= 0:
+            in_b[line] = -1 if line in in_b else j
+
+    pairs = [(in_a[line], j) for line, j in in_b.items() if j >= 0]
+    pairs.sort(key=lambda p: p[1])
+
+    # Patience sorting: `tails[k]` is the smallest `i` ending an increasing
+    # run of length `k + 1`; `back` links every pair to its predecessor.
+    tails: List[int] = []
+    tail_idx: List[int] = []
+    back: List[int] = []
+    for idx, (i, _) in enumerate(pairs):
+        k = bisect_left(tails, i)
+        back.append(tail_idx[k - 1] if k else -1)
+        if k == len(tails):
+            tails.append(i)
+            tail_idx.append(idx)
+        else:
+            tails[k] = i
+            tail_idx[k] = idx
+
+    anchors = []
+    idx = tail_idx[-1] if tail_idx else -1
+    while idx >= 0:
+        anchors.append(pairs[idx])
+        idx = back[idx]
+    anchors.reverse()
+    return anchors
+
+
+def patience_matches(
+    a: Sequence, b: Sequence, budget: Optional[Budget] = None
+) -> Iterator[Match]:
+    """Yield the matching blocks of the patience diff algorithm.
+
+    Lines that are unique in both ranges serve as anchors; the gaps
+    between them are diffed recursively.  Ranges without such lines
+    are left to Myers.
+    """
+    stack: List[tuple] = [(_RANGE, 0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if item[0] == _MATCH:
+            yield item[1:]
+            continue
+        _, alo, ahi, blo, bhi = item
+        if budget:
+            budget.check()
+        prefix, suffix = _trim(a, alo, ahi, b, blo, bhi)
+        if prefix:
+            yield (alo, blo, prefix)
+        if suffix:
+            stack.append((_MATCH, ahi - suffix, bhi - suffix, suffix))
+        alo += prefix
+        blo += prefix
+        ahi -= suffix
+        bhi -= suffix
+        if alo == ahi or blo == bhi:
+            continue
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        if not anchors:
+            yield from myers_matches(a, b, alo, ahi, blo, bhi, budget)
+            continue
+        end_a, end_b = ahi, bhi
+        for i, j in reversed(anchors):
+            stack.append((_RANGE, i + 1, end_a, j + 1, end_b))
+            stack.append((_MATCH, i, j, 1))
+            end_a, end_b = i, j
+        stack.append((_RANGE, alo, end_a, blo, end_b))
+
+
+def _histogram_split(a, alo, ahi, b, blo, bhi):
+    """Find the longest common region built around the rarest lines.
+
+    Returns `(i, j, n)` or `None` if there is no common line at all, or
+    `False` if all common lines are too frequent.
+    """
+    occurrences: Dict[object, List[int]] = {}
+    for i in range(alo, ahi):
+        occurrences.setdefault(a[i], []).append(i)
+
+    best = None
+    best_len = 0
+    best_count = MAX_CHAIN_LENGTH + 1
+    seen_common = False
+    j = blo
+    while j < bhi:
+        positions = occurrences.get(b[j])
+        next_j = j + 1
+        if positions is not None:
+            seen_common = True
+            if len(positions) <= best_count:
+                for i in positions:
+                    s, t = i, j
+                    count = len(positions)
+                    while s > alo and t > blo and a[s - 1] == b[t - 1]:
+                        s -= 1
+                        t -= 1
+                        count = min(count, len(occurrences[a[s]]))
+                    e, f = i + 1, j + 1
+                    while e < ahi and f < bhi and a[e] == b[f]:
+                        count = min(count, len(occurrences[a[e]]))
+                        e += 1
+                        f += 1
+                    if e - s > best_len or count < best_count:
+                        best = (s, t, e - s)
+                        best_len = e - s
+                        best_count = count
+                    next_j = max(next_j, f)
+        j = next_j
+
+    if best is None:
+        return False if seen_common else None
+    return best
+
+
+def histogram_matches(
+    a: Sequence, b: Sequence, budget: Optional[Budget] = None
+) -> Iterator[Match]:
+    """Yield the matching blocks of the histogram diff algorithm.
+
+    Like patience, but anchors on the rarest common lines instead of only
+    the unique ones, as popularized by JGit.
+    """
+    stack: List[tuple] = [(_RANGE, 0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if item[0] == _MATCH:
+            yield item[1:]
+            continue
+        _, alo, ahi, blo, bhi = item
+        if budget:
+            budget.check()
+        prefix, suffix = _trim(a, alo, ahi, b, blo, bhi)
+        if prefix:
+            yield (alo, blo, prefix)
+        if suffix:
+            stack.append((_MATCH, ahi - suffix, bhi - suffix, suffix))
+        alo += prefix
+        blo += prefix
+        ahi -= suffix
+        bhi -= suffix
+        if alo == ahi or blo == bhi:
+            continue
+        split = _histogram_split(a, alo, ahi, b, blo, bhi)
+        if split is None:
+            continue
+        if split is False:
+            yield from myers_matches(a, b, alo, ahi, blo, bhi, budget)
+            continue
+        i, j, n = split
+        stack.append((_RANGE, i + n, ahi, j + n, bhi))
+        stack.append((_MATCH, i, j, n))
+        stack.append((_RANGE, alo, i, blo, j))
+
+
+def anchor_matches(a: Sequence, b: Sequence) -> Iterator[Match]:
+    """Yield the matching blocks around the lines unique in both sequences.
+
+    Between these anchors only the common head and tail of each gap are
+    matched, the gaps are not diffed any further.  That is linear, apart
+    from sorting the anchors, whatever the input.
+    """
+    la, lb = len(a), len(b)
+    i = j = 0
+    for ai, bj in _unique_anchors(a, 0, la, b, 0, lb) + [(la, lb)]:
+        prefix, suffix = _trim(a, i, ai, b, j, bj)
+        yield (i, j, prefix)
+        yield (ai - suffix, bj - suffix, suffix)
+        if ai < la:
+            yield (ai, bj, 1)
+        i, j = ai + 1, bj + 1
+
+
+def ndiff_opcodes(
+    a: Sequence[str], b: Sequence[str], budget: Optional[Budget] = None
+) -> Iterator[Opcode]:
+    """Opcodes of a Myers diff, with the fuzzy line pairing of `difflib.ndiff`.
+
+    Only the lines of each "replace" block are paired: a "-" line
+    immediately followed by a "+" line (ignoring "?" hint lines) forms a
+    1:1 "replace"; all other changes are plain "delete"s and "insert"s.
+    This is slow, up to cubic in the size of a block, but finds similar
+    lines in otherwise unrelated blocks.
+
+    ndiff does not yield before it is done with a block, so the `budget`
+    caps the pairs of lines of the blocks up front.
+    """
+    opcodes = list(opcodes_from_matches(myers_matches(a, b, budget=budget), len(a), len(b)))
+    if budget:
+        budget.check_pairs(max(
+            ((i2 - i1) * (j2 - j1) for tag, i1, i2, j1, j2 in opcodes if tag == 'replace'),
+            default=0
+        ))
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'replace':
+            if budget:
+                budget.check()
+            yield from _ndiff_block(a, i1, i2, b, j1, j2)
+        else:
+            yield (tag, i1, i2, j1, j2)
+
+
+def _ndiff_block(a, i1, i2, b, j1, j2):
+    ops: List[list] = []
+
+    def add(tag, i1, i2, j1, j2):
+        if ops:
+            last = ops[-1]
+            if last[0] == tag and last[2] == i1 and last[4] == j1:
+                last[2] = i2
+                last[4] = j2
+                return
+        ops.append([tag, i1, i2, j1, j2])
+
+    i, j = i1, j1
+    pending_removal = False
+    for line in difflib.ndiff(a[i1:i2], b[j1:j2], charjunk=None):
+        code = line[:1]
+        if code == ' ':
+            add('equal', i, i + 1, j, j + 1)
+            i += 1
+            j += 1
+        elif code == '-':
+            add('delete', i, i + 1, j, j)
+            i += 1
+        elif code == '+':
+            if pending_removal:
+                # Pull the last removal out of its "delete" run and pair it.
+                last = ops[-1]
+                last[2] -= 1
+                if last[1] == last[2]:
+                    ops.pop()
+                add('replace', i - 1, i, j, j + 1)
+            else:
+                add('insert', i, i, j, j + 1)
+            j += 1
+        if code != '?':
+            pending_removal = code == '-'
+
+    return [(tag, i1, i2, j1, j2) for tag, i1, i2, j1, j2 in ops]
+
+
+def _from_matches(matcher):
+    def engine(a: Sequence, b: Sequence, **kwargs) -> Iterator[Opcode]:
+        return opcodes_from_matches(matcher(a, b, **kwargs), len(a), len(b))
+    return engine
+
+
+ENGINES: Dict[str, Engine] = {
+    'myers': _from_matches(myers_matches),
+    'patience': _from_matches(patience_matches),
+    'histogram': _from_matches(histogram_matches),
+    'ndiff': ndiff_opcodes,
+    ANCHOR_ENGINE: _from_matches(anchor_matches),
+}
@@ -0,0 +1,217 @@
+"""Read files from disk without going through editor views.
+
+Files are memory-mapped and decoded chunk by chunk, with their line
+endings normalized to "\\n" just like Sublime does when it loads them.
+Like Sublime, we honor byte order marks, then try UTF-8, then the
+fallback encoding.
+"""
+from __future__ import annotations
+import codecs
+from contextlib import nullcontext
+import hashlib
+import mmap
+import os
+import re
+
+from typing import Callable, Iterator, List, Optional, Tuple
+
+# Decode this many bytes at a time.
+READ_CHUNK = 1 << 22
+# Like Sublime, we fall back to a single byte encoding for files which
+# are not valid UTF-8.  Latin-1 decodes any byte, so it is the last resort.
+FALLBACK_ENCODING = 'latin-1'
+# The byte order marks of UTF-32 first, the one of UTF-32-LE starts with
+# the one of UTF-16-LE.
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def bom_encoding(data: bytes) -> Optional[str]:
+    """Return the encoding of the byte order mark `data` starts with, if any."""
+    for bom, encoding in BOMS:
+        if data[:len(bom)] == bom:
+            return encoding
+    return None
+
+
+def python_encoding(name: Optional[str]) -> Optional[str]:
+    """Return the Python codec of an encoding named like Sublime does, if any.
+
+    Sublime names them like "Western (Windows 1252)" or "Cyrillic (KOI8-R)".
+    """
+    if not name:
+        return None
+    match = re.search(r'\(([^)]+)\)', name)
+    label = match.group(1) if match else name
+    label = re.sub(r'^(?:Windows|DOS) ', 'cp', label)
+    try:
+        return codecs.lookup(label.replace(' ', '-')).name
+    except LookupError:
+        return None
+
+
+def _encodings(data, fallback: str) -> List[str]:
+    """Return the encodings to try on `data`, in order."""
+    bom = bom_encoding(data[:4])
+    tried = [bom] if bom else ['utf-8', fallback]
+    return list(dict.fromkeys(tried + [FALLBACK_ENCODING]))
+
+
+def read_manifest(path: str) -> List[Tuple[str, str]]:
+    """Return the pairs of files listed in the manifest at `path`.
+
+    Every line names two files separated by a tab.  Empty lines and lines
+    starting with "#" are skipped.  Relative paths are relative to the
+    manifest.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) != 2:
+                raise ValueError(f"{path}:{number}: expected two files separated by a tab")
+            fileA, fileB = (os.path.join(base, field.strip()) for field in fields)
+            pairs.append((fileA, fileB))
+    return pairs
+
+
+def same_contents(path1: str, path2: str) -> bool:
+    """Return whether both files have the very same bytes."""
+    if os.path.getsize(path1) != os.path.getsize(path2):
+        return False
+    with open(path1, 'rb') as f1, open(path2, 'rb') as f2:
+        if not os.fstat(f1.fileno()).st_size:
+            return True
+        with _map(f1) as data1, _map(f2) as data2:
+            # The chunks are compared in C, and we stop at the first difference.
+            for pos in range(0, len(data1), READ_CHUNK):
+                if data1[pos:pos + READ_CHUNK] != data2[pos:pos + READ_CHUNK]:
+                    return False
+    return True
+
+
+def file_digest(path: str) -> str:
+    """Return a digest of the bytes of the file at `path`."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            with _map(f) as data:
+                for pos in range(0, len(data), READ_CHUNK):
+                    digest.update(data[pos:pos + READ_CHUNK])
+    return digest.hexdigest()
+
+
+def read_text(
+    path: str,
+    on_progress: Optional[Callable[[float], None]] = None,
+    fallback: str = FALLBACK_ENCODING
+) -> str:
+    """Return the text of the file at `path`.
+
+    `on_progress` is called with the fraction read so far.  It may raise
+    to abort reading.  Files which are neither marked by a byte order
+    mark nor valid UTF-8 are decoded with `fallback`.
+    """
+    if on_progress is None:
+        on_progress = lambda progress: None
+
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return ''
+        with _map(f) as data:
+            *encodings, last = _encodings(data, fallback)
+            for encoding in encodings:
+                try:
+                    return ''.join(_decode(data, encoding, on_progress))
+                except UnicodeDecodeError:
+                    pass
+            return ''.join(_decode(data, last, on_progress))
+
+
+def same_text(path1: str, path2: str, fallback: str = FALLBACK_ENCODING) -> bool:
+    """Return whether both files read as the same text, see `read_text`.
+
+    They may still differ in their line endings or encodings.  We stop
+    decoding at the first difference, even if the rest of a file turns
+    out not to be UTF-8, which would change how all of it reads.  That
+    errs on the side of "not the same".
+    """
+    with open(path1, 'rb') as f1, open(path2, 'rb') as f2:
+        with _map_contents(f1) as data1, _map_contents(f2) as data2:
+            encodings = [_encodings(data1, fallback), _encodings(data2, fallback)]
+            while True:
+                try:
+                    return _same_chunks(
+                        _decode_side(data1, encodings[0][0], 0),
+                        _decode_side(data2, encodings[1][0], 1)
+                    )
+                except _Undecodable as e:
+                    # The last resort decodes anything.
+                    encodings[e.side].pop(0)
+
+
+def _map(f) -> mmap.mmap:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _map_contents(f):
+    # Empty files can't be mapped.
+    return _map(f) if os.fstat(f.fileno()).st_size else nullcontext(b'')
+
+
+def _decode(
+    data: mmap.mmap, encoding: str, on_progress: Callable[[float], None] = lambda progress: None
+) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder(encoding)()
+    size = len(data)
+    # A "\r" ending a chunk may be the first half of a "\r\n".
+    pending = ''
+    for pos in range(0, size, READ_CHUNK):
+        on_progress(pos / size)
+        end = pos + READ_CHUNK
+        text = pending + decoder.decode(data[pos:end], end >= size)
+        if text.endswith('\r') and end < size:
+            text, pending = text[:-1], '\r'
+        else:
+            pending = ''
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        yield text
+
+
+class _Undecodable(Exception):
+    def __init__(self, side: int) -> None:
+        self.side = side
+
+
+def _decode_side(data: mmap.mmap, encoding: str, side: int) -> Iterator[str]:
+    try:
+        yield from _decode(data, encoding)
+    except UnicodeDecodeError:
+        raise _Undecodable(side)
+
+
+def _same_chunks(chunks1: Iterator[str], chunks2: Iterator[str]) -> bool:
+    text1: Optional[str] = ''
+    text2: Optional[str] = ''
+    while True:
+        # Chunks may be empty, and they rarely line up.
+        while text1 == '':
+            text1 = next(chunks1, None)
+        while text2 == '':
+            text2 = next(chunks2, None)
+        if text1 is None or text2 is None:
+            return text1 is text2
+        n = min(len(text1), len(text2))
+        if text1[:n] != text2[:n]:
+            return False
+        text1, text2 = text1[n:], text2[n:]
@@ -0,0 +1,60 @@
+"""An index of the hunks, the blocks of contiguous changed rows."""
+from __future__ import annotations
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import merge
+
+from typing import Callable, Iterable, Optional, Tuple
+
+
+class HunkIndex:
+    """Hunks as sorted `starts` and `ends` (exclusive) rows.
+
+    Rows are the rows of the comparison views, which are the same in
+    both views thanks to the padding.
+    """
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, starts: Iterable[int] = (), ends: Iterable[int] = ()) -> None:
+        self.starts = array('I', starts)
+        self.ends = array('I', ends)
+
+    @classmethod
+    def from_rows(cls, highlightA: Iterable[int], highlightB: Iterable[int]) -> HunkIndex:
+        """Build the index from the sorted changed rows of both sides."""
+        index = cls()
+        starts, ends = index.starts, index.ends
+        for row in merge(highlightA, highlightB):
+            if ends and row <= ends[-1]:
+                if row == ends[-1]:
+                    ends[-1] = row + 1
+                continue
+            starts.append(row)
+            ends.append(row + 1)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, n: int) -> Tuple[int, int]:
+        return self.starts[n], self.ends[n]
+
+    def next(self, row: int) -> Optional[int]:
+        """Return the number of the first hunk starting after `row`."""
+        n = bisect_right(self.starts, row)
+        return n if n < len(self.starts) else None
+
+    def prev(self, row: int) -> Optional[int]:
+        """Return the number of the last hunk starting before `row`."""
+        n = bisect_left(self.starts, row)
+        return n - 1 if n else None
+
+    def at(self, row: int) -> Optional[int]:
+        """Return the number of the hunk containing `row`."""
+        n = bisect_right(self.starts, row) - 1
+        return n if n >= 0 and row < self.ends[n] else None
+
+    def remap(self, row_map: Callable[[int], int]) -> None:
+        """Move the hunks to the rows `row_map` maps their rows to, e.g. after edits."""
+        self.starts = array('I', map(row_map, self.starts))
+        self.ends = array('I', map(row_map, self.ends))
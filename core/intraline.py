@@ -0,0 +1,78 @@
+"""Diff two versions of a line.
+
+Instead of comparing character by character, lines are split into words,
+whitespace runs and punctuation, and we diff these tokens.  Only short
+replaced runs of tokens get refined down to single characters.  Very
+long lines (think minified JSON) are diffed at even coarser granularity.
+"""
+from __future__ import annotations
+import difflib
+from itertools import accumulate
+from os.path import commonprefix
+import re
+
+from typing import Any, Dict, Iterator, List
+
+from .engines import Opcode, get_opcodes
+from .lines import intern_lines
+
+WORD_TOKENS = re.compile(r'\w+|\s+|[^\w\s]')
+# Chunks ending in whitespace or structural punctuation, e.g. a whole
+# `"key":"value",` in minified JSON.
+COARSE_TOKENS = re.compile(r'[^\s,;{}()\[\]<>]+[\s,;{}()\[\]<>]*|[\s,;{}()\[\]<>]+')
+
+# Lines longer than this are split into coarse chunks only.
+DEFAULT_TOKEN_LIMIT = 10000
+# Lines longer than this only get their common prefix and suffix trimmed.
+DEFAULT_LINE_LIMIT = 1000000
+# Replaced runs of tokens up to this many characters (on each side) are
+# refined to the characters that actually differ.
+DEFAULT_REFINE_LIMIT = 80
+
+
+def diff_line(left: str, right: str, options: Dict[str, Any]) -> Iterator[Opcode]:
+    """Yield the opcodes, in character offsets, for the differing parts."""
+    longest = max(len(left), len(right))
+    if longest > options.get('intraline_line_limit', DEFAULT_LINE_LIMIT):
+        yield from _affix_opcodes(left, right)
+        return
+
+    if longest > options.get('intraline_token_limit', DEFAULT_TOKEN_LIMIT):
+        pattern = COARSE_TOKENS
+    else:
+        pattern = WORD_TOKENS
+    tokensA = pattern.findall(left)
+    tokensB = pattern.findall(right)
+    offsetsA = _offsets(tokensA)
+    offsetsB = _offsets(tokensB)
+    idsA, idsB = intern_lines(tokensA, tokensB)
+
+    refine_limit = options.get('intraline_refine_limit', DEFAULT_REFINE_LIMIT)
+    for tag, i1, i2, j1, j2 in get_opcodes(idsA, idsB, 'histogram'):
+        if tag == 'equal':
+            continue
+        a1, a2, b1, b2 = offsetsA[i1], offsetsA[i2], offsetsB[j1], offsetsB[j2]
+        if tag == 'replace' and a2 - a1 <= refine_limit and b2 - b1 <= refine_limit:
+            s = difflib.SequenceMatcher(None, left[a1:a2], right[b1:b2], autojunk=False)
+            for tag_, x1, x2, y1, y2 in s.get_opcodes():
+                if tag_ != 'equal':
+                    yield (tag_, a1 + x1, a1 + x2, b1 + y1, b1 + y2)
+        else:
+            yield (tag, a1, a2, b1, b2)
+
+
+def _offsets(tokens: List[str]) -> List[int]:
+    return list(accumulate(map(len, tokens), initial=0))
+
+
+def _affix_opcodes(left: str, right: str) -> Iterator[Opcode]:
+    prefix = len(commonprefix([left, right]))
+    limit = min(len(left), len(right)) - prefix
+    suffix = min(limit, len(commonprefix([left[::-1], right[::-1]])))
+    a2, b2 = len(left) - suffix, len(right) - suffix
+    if prefix < a2 and prefix < b2:
+        yield ('replace', prefix, a2, prefix, b2)
+    elif prefix < a2:
+        yield ('delete', prefix, a2, prefix, prefix)
+    elif prefix < b2:
+        yield ('insert', prefix, prefix, prefix, b2)
@@ -0,0 +1,78 @@
+"""Compact representations of the lines we diff."""
+from __future__ import annotations
+from array import array
+from itertools import accumulate, islice
+
+from typing import Dict, Iterable, Iterator, Tuple
+
+# Work on slices of about this many characters or lines at a time.  That
+# keeps the per-line work in C but the temporary copies small.
+CHUNK_SIZE = 1 << 20
+LINES_PER_CHUNK = 4096
+
+
+class LineIndex:
+    """The lines of a text as offsets into it, without copying them.
+
+    Like `str.splitlines`, a trailing newline does not start another
+    line, but only "\\n" breaks lines, just like in a Sublime view.
+    """
+    __slots__ = ('text', 'starts')
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        starts = array('I')
+        if text:
+            starts.append(0)
+        pos = 0
+        while True:
+            end = text.rfind('\n', pos, pos + CHUNK_SIZE)
+            if end < 0:
+                end = text.find('\n', pos + CHUNK_SIZE)
+                if end < 0:
+                    break
+            lengths = map(len, text[pos:end].split('\n'))
+            starts.extend(islice(accumulate(map((1).__add__, lengths), initial=pos), 1, None))
+            pos = end + 1
+        if starts and starts[-1] == len(text):
+            starts.pop()
+        self.starts = starts
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(0, len(self.starts), LINES_PER_CHUNK):
+            yield from self.span(i, min(i + LINES_PER_CHUNK, len(self.starts))).split('\n')
+
+    def end(self, i: int) -> int:
+        """Return the offset of the end of line `i`, excluding its newline."""
+        if i + 1 < len(self.starts):
+            return self.starts[i + 1] - 1
+        text = self.text
+        return len(text) - 1 if text.endswith('\n') else len(text)
+
+    def line(self, i: int) -> str:
+        return self.text[self.starts[i]:self.end(i)]
+
+    def span(self, i1: int, i2: int) -> str:
+        """Return the lines `i1` to `i2` (exclusive) joined by newlines."""
+        return self.text[self.starts[i1]:self.end(i2 - 1)]
+
+
+class _Ids(Dict[str, int]):
+    def __missing__(self, line: str) -> int:
+        self[line] = id_ = len(self)
+        return id_
+
+
+def intern_lines(linesA: Iterable[str], linesB: Iterable[str]) -> Tuple[array, array]:
+    """Map equal lines to equal integer ids.
+
+    Comparing two ids is much cheaper than comparing two strings, and the
+    `array('I')` buffers are a fraction of the size of the lists.
+    """
+    ids = _Ids()
+    tokensA = array('I', map(ids.__getitem__, linesA))
+    tokensB = array('I', map(ids.__getitem__, linesB))
+    return tokensA, tokensB
@@ -0,0 +1,171 @@
+"""Per-phase timings and sizes of a comparison.
+
+A comparison runs in phases on different threads: reading, diffing,
+filling the views, highlighting, the intraline diff.  `Metrics` collects
+one record per phase, which can be summarized in one line or appended
+as JSON to a log.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+import json
+import threading
+import time
+import tracemalloc
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar('T')
+Record = Dict[str, Any]
+
+# The records measuring memory right now, of all `Metrics`.  Resetting
+# the peak of `tracemalloc` for a new phase folds it into these first.
+_measuring: List[Record] = []
+_measuring_lock = threading.Lock()
+
+
+class Metrics:
+    """The `records` of the phases of one comparison, in the order they started.
+
+    With `memory`, every phase also records the peak of the memory
+    traced by `tracemalloc` while it ran, which slows Python down a lot.
+    Without `tracemalloc.reset_peak` (Python < 3.9) that is the peak
+    since tracing started minus the memory in use when the phase
+    started, i.e. an upper bound.  Work done in worker
+    processes is not traced at all.
+    """
+    __slots__ = ('label', 'records', 'started', 'lock', 'memory', 'tracing', 'reported')
+
+    def __init__(self, label: str, memory: bool = False) -> None:
+        self.label = label
+        self.records: List[Record] = []
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.memory = memory
+        self.reported = False
+        # whether we started tracing, and have to stop it
+        self.tracing = memory and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start()
+
+    def begin(self, phase: str, **sizes: Any) -> Record:
+        """Start a phase, return its record to add sizes to and `end` it with."""
+        record = {'phase': phase, 'seconds': 0.0, **sizes}
+        with self.lock:
+            self.records.append(record)
+        self._start(record)
+        return record
+
+    def end(self, record: Record) -> None:
+        record['seconds'] = round(time.perf_counter() - record.pop('_start'), 4)
+        if '_memory' not in record:
+            return
+        with _measuring_lock:
+            _measuring.remove(record)
+            memory, peak = record.pop('_memory'), record.pop('_peak')
+            if tracemalloc.is_tracing():
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+        record['peak_bytes'] = max(0, peak - memory)
+
+    @contextmanager
+    def phase(self, phase: str, **sizes: Any) -> Iterator[Record]:
+        record = self.begin(phase, **sizes)
+        try:
+            yield record
+        finally:
+            self.end(record)
+
+    @contextmanager
+    def piece(self, phase: str) -> Iterator[Record]:
+        """Measure a piece of a phase which runs piecemeal, e.g. in batches.
+
+        The seconds and the sizes of all pieces add up, their peak memory
+        is the maximum.
+        """
+        piece: Record = {}
+        self._start(piece)
+        try:
+            yield piece
+        finally:
+            self.end(piece)
+            with self.lock:
+                record = next((r for r in self.records if r['phase'] == phase), None)
+                if record is None:
+                    record = {'phase': phase, 'seconds': 0.0}
+                    self.records.append(record)
+                for key, value in piece.items():
+                    if key == 'peak_bytes':
+                        record[key] = max(record.get(key, 0), value)
+                    else:
+                        record[key] = round(record.get(key, 0) + value, 4)
+
+    def _start(self, record: Record) -> None:
+        if self.memory and tracemalloc.is_tracing():
+            with _measuring_lock:
+                if hasattr(tracemalloc, 'reset_peak'):
+                    peak = tracemalloc.get_traced_memory()[1]
+                    for other in _measuring:
+                        other['_peak'] = max(other['_peak'], peak)
+                    tracemalloc.reset_peak()
+                record['_memory'] = record['_peak'] = tracemalloc.get_traced_memory()[0]
+                _measuring.append(record)
+        record['_start'] = time.perf_counter()
+
+    def timed(self, record: Record, key: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Yield from `iterable`, adding the seconds spent producing items to `record[key]`."""
+        iterator = iter(iterable)
+        seconds = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+                yield item
+        finally:
+            record[key] = round(record.get(key, 0.0) + seconds, 4)
+
+    def summary(self) -> str:
+        """Return the durations of the phases, without their sub-phases like "diff.join"."""
+        with self.lock:
+            records = [r for r in self.records if '.' not in r['phase']]
+        return ', '.join(f"{r['phase']} {r['seconds']:.2f}s" for r in records)
+
+    def report(self) -> Record:
+        with self.lock:
+            records = [
+                {key: value for key, value in r.items() if not key.startswith('_')}
+                for r in self.records
+            ]
+        return {'label': self.label, 'started': round(self.started, 3), 'phases': records}
+
+    def append_to(self, path: str) -> None:
+        """Append the report to the JSON lines log at `path`."""
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.report(), ensure_ascii=False) + '\n')
+
+    def close(self) -> None:
+        if self.tracing:
+            self.tracing = False
+            tracemalloc.stop()
+
+
+def maybe_phase(metrics: Optional[Metrics], phase: str, **sizes: Any):
+    """`metrics.phase(...)`, or a no-op without `metrics`."""
+    if metrics is None:
+        return _no_phase()
+    return metrics.phase(phase, **sizes)
+
+
+def maybe_piece(metrics: Optional[Metrics], phase: str):
+    """`metrics.piece(...)`, or a no-op without `metrics`."""
+    if metrics is None:
+        return _no_phase()
+    return metrics.piece(phase)
+
+
+@contextmanager
+def _no_phase() -> Iterator[Record]:
+    yield {}
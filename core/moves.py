@@ -0,0 +1,74 @@
+"""Blocks of lines moved from one place to another.
+
+A line diff reports a moved block as a deletion here plus an insertion
+there.  We index all runs of `min_lines` added lines by their lines, and
+look up the runs of removed lines in that index, so that finding the
+moves takes linear expected time.
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from .engines import Opcode
+from .lines import LineIndex
+
+# Shorter runs of lines are not worth calling moved.
+DEFAULT_MIN_LINES = 3
+
+
+def find_moves(
+    seqA: Sequence,
+    seqB: Sequence,
+    opcodes: Iterable[Opcode],
+    min_lines: int,
+    linesA: LineIndex
+) -> Tuple[bytearray, bytearray]:
+    """Return flags marking the moved lines of `seqA` and of `seqB`.
+
+    `seqA` and `seqB` are the (normalized) lines as diffed, `opcodes` are
+    their diff, and `linesA` the original lines of A.  A move is a run of
+    at least `min_lines` lines removed from A and added to B, which are
+    not all blank.
+    """
+    movedA = bytearray(len(seqA))
+    movedB = bytearray(len(seqB))
+    addedB = bytearray(len(seqB))
+    removed: List[Tuple[int, int]] = []
+    # the starts of the runs of added lines, by their lines, last first
+    index: Dict[tuple, List[int]] = {}
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            continue
+        if i2 - i1 >= min_lines:
+            removed.append((i1, i2))
+        addedB[j1:j2] = b'\1' * (j2 - j1)
+        for j in range(j2 - min_lines, j1 - 1, -1):
+            index.setdefault(tuple(seqB[j:j + min_lines]), []).append(j)
+
+    lenB = len(seqB)
+    for i1, i2 in removed:
+        i = i1
+        while i <= i2 - min_lines:
+            candidates = index.get(tuple(seqA[i:i + min_lines]))
+            if candidates is None or all(
+                not linesA.line(k).strip() for k in range(i, i + min_lines)
+            ):
+                i += 1
+                continue
+            # Candidates overlapping a move never become free again.
+            while candidates and any(movedB[candidates[-1]:candidates[-1] + min_lines]):
+                candidates.pop()
+            if not candidates:
+                i += 1
+                continue
+            j = candidates.pop()
+            n = min_lines
+            while (
+                i + n < i2 and j + n < lenB and addedB[j + n] and not movedB[j + n]
+                and seqA[i + n] == seqB[j + n]
+            ):
+                n += 1
+            movedA[i:i + n] = b'\1' * n
+            movedB[j:j + n] = b'\1' * n
+            i += n
+    return movedA, movedB
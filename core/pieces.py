@@ -0,0 +1,233 @@
+"""A diff result cut into pieces, to fill the views with one at a time.
+
+The first piece is just the first screenful of rows, so that it can be
+drawn right away; the following pieces grow up to a maximum size.  Both
+sides are cut at the same rows, so the views line up while they fill.
+Diffs are cut while they are assembled already, in-process or in a
+worker process, see `PieceStream`.
+"""
+from __future__ import annotations
+from bisect import bisect_right
+
+from typing import Callable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from .diff import BufferBuilder, DiffResult, Span
+from .lines import LineIndex
+
+
+class DiffPiece(NamedTuple):
+    # the text to append to either view
+    textA: str
+    textB: str
+    # the spans of `DiffResult` within this piece, still as offsets into
+    # the whole buffers
+    regionsA: List[Span]
+    regionsB: List[Span]
+    movedA: List[Span]
+    movedB: List[Span]
+
+
+def iter_pieces(
+    result: DiffResult, first_rows: int, min_size: int, max_size: int
+) -> Iterator[DiffPiece]:
+    """Yield the pieces of `result`, starting with its first `first_rows` rows.
+
+    The next pieces have at least `min_size` characters on one side, and
+    double in size up to `max_size` characters.
+    """
+    bufferA, bufferB = result.bufferA, result.bufferB
+    spans = [_SpanCutter(s) for s in (
+        result.regionsA, result.regionsB, result.movedA, result.movedB
+    )]
+
+    def piece(startA: int, endA: int, startB: int, endB: int) -> DiffPiece:
+        # The last piece takes all the rest, even the spans ending the text.
+        cutA = endA if endA < len(bufferA) else len(bufferA) + 1
+        cutB = endB if endB < len(bufferB) else len(bufferB) + 1
+        return DiffPiece(
+            bufferA[startA:endA], bufferB[startB:endB],
+            spans[0].take(cutA), spans[1].take(cutB), spans[2].take(cutA), spans[3].take(cutB)
+        )
+
+    # No need to index all the rows for the first screen.
+    startA, startB = _row_start(bufferA, first_rows), _row_start(bufferB, first_rows)
+    yield piece(0, startA, 0, startB)
+    if startA >= len(bufferA) and startB >= len(bufferB):
+        return
+
+    startsA, startsB = LineIndex(bufferA).starts, LineIndex(bufferB).starts
+    row = first_rows
+    size = min_size
+    while startA < len(bufferA) or startB < len(bufferB):
+        # the most rows either side has in `size` characters, at least one
+        end = max(
+            min(bisect_right(startsA, startA + size), bisect_right(startsB, startB + size)),
+            row + 1
+        )
+        endA = startsA[end] if end < len(startsA) else len(bufferA)
+        endB = startsB[end] if end < len(startsB) else len(bufferB)
+        yield piece(startA, endA, startB, endB)
+        row, startA, startB = end, endA, endB
+        size = min(size * 2, max_size)
+
+
+class PieceStream:
+    """Cut the buffers of a diff into pieces while they are assembled.
+
+    The pieces are cut as `iter_pieces` does, but go to `emit` as soon as
+    they are complete, in the thread computing the diff.  Their regions
+    include the moved lines, which are only found once the diff is done.
+    Should the diff start over with a coarser algorithm, see
+    `core.budget`, `emit` gets None: the pieces so far are void.
+    """
+    def __init__(
+        self,
+        emit: Callable[[Optional[DiffPiece]], None],
+        first_rows: int,
+        min_size: int,
+        max_size: int
+    ) -> None:
+        self.emit = emit
+        self.first_rows = first_rows
+        self.min_size = min_size
+        self.max_size = max_size
+        self.emitted = False
+        self.size = min_size
+        self.sides: Optional[Tuple[_Pending, _Pending]] = None
+
+    def start(self) -> None:
+        """Start over with the buffers of another attempt at the diff."""
+        if self.emitted:
+            self.emit(None)
+        self.emitted = False
+        self.size = self.min_size
+        self.sides = None
+
+    def feed(
+        self,
+        row: int,
+        bufferA: BufferBuilder,
+        bufferB: BufferBuilder,
+        regionsA: List[Span],
+        regionsB: List[Span],
+        last: bool = False
+    ) -> None:
+        """Emit the pieces complete by now, `row` rows are assembled.
+
+        The buffers and regions only ever grow until the `last` call.
+        """
+        if self.sides is None:
+            self.sides = (_Pending(bufferA, regionsA), _Pending(bufferB, regionsB))
+        A, B = self.sides
+        if not self.emitted:
+            if row < self.first_rows and not last:
+                return
+            self.put(A.take(self.first_rows), B.take(self.first_rows))
+        while A.size() >= self.size or B.size() >= self.size:
+            # the most rows either side has in `size` characters, at least one
+            rows = max(min(A.rows_within(self.size), B.rows_within(self.size)), 1)
+            self.put(A.take(rows), B.take(rows))
+            self.size = min(self.size * 2, self.max_size)
+        if last and (A.size() or B.size()):
+            self.put(A.take(None), B.take(None))
+
+    def sizes(self) -> Tuple[int, int, int]:
+        """Return the sizes to cut pieces in, for a stream elsewhere to `relay`."""
+        return self.first_rows, self.min_size, self.max_size
+
+    def relay(self, piece: Optional[DiffPiece]) -> None:
+        """Pass on a piece cut by another stream, e.g. in a worker process."""
+        self.emitted = piece is not None
+        self.emit(piece)
+
+    def put(self, a: Tuple[str, List[Span]], b: Tuple[str, List[Span]]) -> None:
+        self.emitted = True
+        self.emit(DiffPiece(a[0], b[0], a[1], b[1], [], []))
+
+
+class _Pending:
+    """The text of one buffer assembled but not emitted yet, and its regions."""
+    __slots__ = ('buffer', 'parts', 'text', 'pos', 'offset', 'cutter')
+
+    def __init__(self, buffer: BufferBuilder, regions: List[Span]) -> None:
+        self.buffer = buffer
+        # the parts of the buffer in `text`, which starts at `offset` of
+        # the buffer and is emitted up to `pos`
+        self.parts = 0
+        self.text = ''
+        self.pos = 0
+        self.offset = 0
+        self.cutter = _SpanCutter(regions)
+
+    def size(self) -> int:
+        return self.buffer.size - self.offset - self.pos
+
+    def rows_within(self, size: int) -> int:
+        self._merge()
+        return self.text.count('\n', self.pos, self.pos + size)
+
+    def take(self, rows: Optional[int]) -> Tuple[str, List[Span]]:
+        """Return the text of the next `rows` rows, or all of it, and its regions."""
+        self._merge()
+        text, pos = self.text, self.pos
+        end = len(text) if rows is None else _row_start(text, rows, pos)
+        # At the end of what is assembled, no region goes on.
+        cut = self.offset + end if end < len(text) else self.offset + end + 1
+        self.pos = end
+        return text[pos:end], self.cutter.take(cut)
+
+    def _merge(self) -> None:
+        parts = self.buffer.parts
+        if self.parts < len(parts):
+            rest = [self.text[self.pos:]] if self.parts else []
+            self.text = '\n'.join(rest + parts[self.parts:])
+            self.offset += self.pos
+            self.pos = 0
+            self.parts = len(parts)
+
+
+def _row_start(text: str, row: int, pos: int = 0) -> int:
+    """Return the offset of the `row`-th row after `pos` in `text`.
+
+    That is the length of `text` if it has less rows.
+    """
+    for _ in range(row):
+        pos = text.find('\n', pos) + 1
+        if not pos:
+            return len(text)
+    return pos
+
+
+class _SpanCutter:
+    """Hand out sorted, disjoint spans up to a cut, splitting the span across it."""
+    __slots__ = ('spans', 'k', 'rest')
+
+    def __init__(self, spans: Sequence[Span]) -> None:
+        self.spans = spans
+        self.k = 0
+        # the rest of a span we cut, not handed out yet
+        self.rest: Optional[Span] = None
+
+    def take(self, cut: int) -> List[Span]:
+        """Return the spans before `cut`, the start of a row or the end of the text."""
+        taken: List[Span] = []
+        spans = self.spans
+        while self.rest or self.k < len(spans):
+            if self.rest:
+                a, b = self.rest
+            else:
+                a, b = spans[self.k]
+            if a >= cut:
+                break
+            if self.rest:
+                self.rest = None
+            else:
+                self.k += 1
+            if b < cut:
+                taken.append((a, b))
+            else:
+                # Cut before the newline ending the row.
+                taken.append((a, cut - 1))
+                self.rest = (cut, b)
+                break
+        return taken
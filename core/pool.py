@@ -0,0 +1,199 @@
+"""A pool of persistent worker processes running the diff core.
+
+Diffing is CPU bound; done in a thread it still holds the GIL of the
+(shared) plugin host.  Workers are plain Python interpreters running
+`core.worker`, so several comparisons can use several cores.
+"""
+from __future__ import annotations
+import os
+import queue
+import subprocess
+import threading
+
+from typing import Callable, List, Optional, Tuple
+
+from . import protocol
+from .diff import DiffResult, IntralineChange, Options, SubHighlight
+from .pieces import DiffPiece, PieceStream
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The diff core uses the walrus and `accumulate(initial=...)`.
+MIN_PYTHON = (3, 8)
+
+
+class WorkerError(Exception):
+    pass
+
+
+class Worker:
+    def __init__(self, python: str) -> None:
+        env = os.environ.copy()
+        # Works for unpacked packages as well as for .sublime-package
+        # archives, Python imports from zip files just fine.
+        env['PYTHONPATH'] = os.pathsep.join(
+            filter(None, [PACKAGE_ROOT, env.get('PYTHONPATH')])
+        )
+        try:
+            self.process = subprocess.Popen(
+                [python, '-u', '-m', 'core.worker'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                env=env,
+                creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0),
+            )
+        except OSError as e:
+            raise WorkerError(f"could not start {python}: {e}")
+        self.handshake(python)
+
+    def handshake(self, python: str) -> None:
+        """Wait for the READY frame, raise `WorkerError` if `python` can't run us."""
+        assert self.process.stdout
+        frame = protocol.read_frame(self.process.stdout)
+        if frame is None or frame[0] != protocol.READY:
+            self.kill()
+            raise WorkerError(f"{python} could not run the diff worker")
+        version = protocol.VERSION.unpack(frame[1])
+        if version < MIN_PYTHON:
+            self.kill()
+            raise WorkerError(
+                f"{python} is Python {'.'.join(map(str, version))}, "
+                f"the diff worker needs {'.'.join(map(str, MIN_PYTHON))} or later"
+            )
+
+    def call(
+        self,
+        kind: int,
+        payload: bytes,
+        on_progress: Callable[[float], None],
+        on_piece: Callable[[Optional[DiffPiece]], None]
+    ) -> bytes:
+        stdin, stdout = self.process.stdin, self.process.stdout
+        assert stdin and stdout
+        try:
+            protocol.write_frame(stdin, kind, payload)
+        except OSError as e:
+            raise WorkerError(f"worker died: {e}")
+        while True:
+            frame = protocol.read_frame(stdout)
+            if frame is None:
+                raise WorkerError(f"worker died with exit code {self.process.poll()}")
+            kind, payload = frame
+            if kind == protocol.PROGRESS:
+                (progress,) = protocol.PROGRESS_VALUE.unpack(payload)
+                on_progress(progress)
+            elif kind == protocol.PIECE:
+                on_piece(protocol.decode_piece(payload))
+            elif kind == protocol.RESULT:
+                return payload
+            elif kind == protocol.ERROR:
+                raise WorkerError(payload.decode('utf-8', 'replace'))
+            else:
+                raise WorkerError(f"unexpected frame kind {kind}")
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self) -> None:
+        try:
+            self.process.kill()
+            self.process.wait(1)
+            for pipe in (self.process.stdin, self.process.stdout):
+                if pipe:
+                    pipe.close()
+        except Exception:
+            pass
+
+
+class WorkerPool:
+    def __init__(self, python: str, size: int) -> None:
+        self.python = python
+        self.size = max(1, size)
+        self.idle: queue.LifoQueue[Worker] = queue.LifoQueue()
+        self.workers: List[Worker] = []
+        self.lock = threading.Lock()
+        # why no worker could be started; we don't try again
+        self.failure: Optional[str] = None
+
+    def acquire(self) -> Worker:
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                if self.failure:
+                    raise WorkerError(self.failure)
+                if len(self.workers) < self.size:
+                    try:
+                        worker = Worker(self.python)
+                    except WorkerError as e:
+                        self.failure = str(e)
+                        raise
+                    self.workers.append(worker)
+                    return worker
+            # Poll, as a busy worker may get discarded instead of released.
+            try:
+                return self.idle.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def release(self, worker: Worker) -> None:
+        if worker.is_alive():
+            self.idle.put(worker)
+        else:
+            self.discard(worker)
+
+    def discard(self, worker: Worker) -> None:
+        worker.kill()
+        with self.lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+
+    def call(
+        self,
+        kind: int,
+        payload: bytes,
+        on_progress: Optional[Callable[[float], None]] = None,
+        on_piece: Optional[Callable[[Optional[DiffPiece]], None]] = None
+    ) -> bytes:
+        worker = self.acquire()
+        try:
+            result = worker.call(
+                kind, payload, on_progress or (lambda progress: None),
+                on_piece or (lambda piece: None)
+            )
+        except BaseException:
+            # If `on_progress` raised to cancel, the worker is still busy
+            # with our request.  Killing it is the only way to stop it.
+            self.discard(worker)
+            raise
+        self.release(worker)
+        return result
+
+    def compute_diff(
+        self,
+        view1_contents: str,
+        view2_contents: str,
+        options: Options,
+        on_progress: Optional[Callable[[float], None]] = None,
+        stream: Optional[PieceStream] = None
+    ) -> DiffResult:
+        """Diff in a worker, which cuts the pieces for the `stream` while it assembles them."""
+        payload = protocol.encode_diff_request(
+            view1_contents, view2_contents, options, stream.sizes() if stream else None
+        )
+        return protocol.decode_diff_result(self.call(
+            protocol.DIFF, payload, on_progress, stream.relay if stream else None
+        ))
+
+    def compute_intraline_differences(
+        self, found_intraline_changes: List[IntralineChange], options: Options
+    ) -> Tuple[List[SubHighlight], List[SubHighlight]]:
+        payload = protocol.encode_intraline_request(found_intraline_changes, options)
+        return protocol.decode_intraline_result(self.call(protocol.INTRALINE, payload))
+
+    def shutdown(self) -> None:
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.kill()
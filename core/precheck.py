@@ -0,0 +1,58 @@
+"""Verdicts on inputs which need no diff at all.
+
+Identical inputs, binary files and files whose text differs only in
+line endings or encoding are told apart before diffing, so that no
+comparison views have to be built for them.
+"""
+from __future__ import annotations
+
+from typing import Optional, Union
+
+from .files import FALLBACK_ENCODING, bom_encoding, same_contents, same_text
+
+IDENTICAL = 'identical'
+BINARY = 'binary'
+# the same text, in different line endings or encodings
+SAME_TEXT = 'same text'
+
+# Like git, look for a NUL in this many bytes to tell binary files.
+SNIFF_SIZE = 8000
+
+
+def looks_binary(data: Union[bytes, str]) -> bool:
+    """Return whether `data`, or its start, looks like binary data."""
+    if isinstance(data, bytes) and bom_encoding(data):
+        # UTF-16 and UTF-32 text is full of NULs.
+        return False
+    nul = b'\0' if isinstance(data, bytes) else '\0'
+    return nul in data[:SNIFF_SIZE]  # type: ignore[operator]
+
+
+def file_looks_binary(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return looks_binary(f.read(SNIFF_SIZE))
+
+
+def file_verdict(
+    path1: str, path2: str, fallback: str = FALLBACK_ENCODING
+) -> Optional[str]:
+    """Return the verdict on two files, or None if they need a diff.
+
+    Files which are not UTF-8 are decoded with `fallback`, see `read_text`.
+    """
+    if same_contents(path1, path2):
+        return IDENTICAL
+    if file_looks_binary(path1) or file_looks_binary(path2):
+        return BINARY
+    if same_text(path1, path2, fallback):
+        return SAME_TEXT
+    return None
+
+
+def text_verdict(text1: str, text2: str) -> Optional[str]:
+    """Return the verdict on two decoded texts, or None if they need a diff."""
+    if text1 == text2:
+        return IDENTICAL
+    if looks_binary(text1) or looks_binary(text2):
+        return BINARY
+    return None
@@ -0,0 +1,245 @@
+"""Binary wire format between the plugin and the diff worker processes.
+
+A frame is a one byte `kind` and a u32 payload length, followed by the
+payload.  Payloads are sequences of length-prefixed fields: UTF-8 text,
+JSON for option dicts, and raw `array('I')` buffers for line numbers.
+"""
+from __future__ import annotations
+from array import array
+import json
+import struct
+
+from typing import IO, List, Optional, Sequence, Tuple
+
+from .diff import DiffResult, IntralineChange, Options, Span, SubHighlight
+from .pieces import DiffPiece
+
+# requests
+DIFF = 1
+INTRALINE = 2
+# responses
+PROGRESS = 3
+RESULT = 4
+ERROR = 5
+# sent once by a worker on startup, with its Python version
+READY = 6
+# a piece of the views, sent while a diff is assembled, see `core.pieces`
+PIECE = 7
+
+# Bump whenever a payload changes; results cached on disk are keyed with it.
+FORMAT = 3
+
+HEADER = struct.Struct('<BI')
+LENGTH = struct.Struct('<I')
+PROGRESS_VALUE = struct.Struct('<d')
+VERSION = struct.Struct('<BB')
+
+
+def write_frame(stream: IO[bytes], kind: int, payload: bytes) -> None:
+    stream.write(HEADER.pack(kind, len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def read_frame(stream: IO[bytes]) -> Optional[Tuple[int, bytes]]:
+    header = _read_exactly(stream, HEADER.size)
+    if header is None:
+        return None
+    kind, length = HEADER.unpack(header)
+    payload = _read_exactly(stream, length)
+    if payload is None:
+        return None
+    return kind, payload
+
+
+def _read_exactly(stream: IO[bytes], size: int) -> Optional[bytes]:
+    chunks = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+class Writer:
+    def __init__(self) -> None:
+        self.parts: List[bytes] = []
+
+    def blob(self, data: bytes) -> 'Writer':
+        self.parts.append(LENGTH.pack(len(data)))
+        self.parts.append(data)
+        return self
+
+    def text(self, text: str) -> 'Writer':
+        return self.blob(text.encode('utf-8', 'surrogatepass'))
+
+    def json(self, value) -> 'Writer':
+        return self.text(json.dumps(value))
+
+    def ints(self, values) -> 'Writer':
+        return self.blob(array('I', values).tobytes())
+
+    def getvalue(self) -> bytes:
+        return b''.join(self.parts)
+
+
+class Reader:
+    def __init__(self, payload: bytes) -> None:
+        self.view = memoryview(payload)
+        self.pos = 0
+
+    def blob(self) -> memoryview:
+        (length,) = LENGTH.unpack_from(self.view, self.pos)
+        start = self.pos + LENGTH.size
+        self.pos = start + length
+        return self.view[start:self.pos]
+
+    def text(self) -> str:
+        return str(self.blob(), 'utf-8', 'surrogatepass')
+
+    def json(self):
+        return json.loads(self.text())
+
+    def ints(self) -> array:
+        values = array('I')
+        values.frombytes(self.blob())
+        return values
+
+
+# Lines never contain line breaks, so we can ship many of them as one
+# joined text field.
+
+def _write_lines(writer: Writer, lines: List[str]) -> None:
+    writer.ints([len(lines)]).text('\n'.join(lines))
+
+
+def _read_lines(reader: Reader) -> List[str]:
+    (count,) = reader.ints()
+    text = reader.text()
+    return text.split('\n') if count else []
+
+
+def _write_intraline_changes(writer: Writer, changes: List[IntralineChange]) -> None:
+    writer.ints([row for row, _, _ in changes])
+    _write_lines(writer, [left for _, left, _ in changes])
+    _write_lines(writer, [right for _, _, right in changes])
+
+
+def _read_intraline_changes(reader: Reader) -> List[IntralineChange]:
+    rows = reader.ints()
+    lefts = _read_lines(reader)
+    rights = _read_lines(reader)
+    return list(zip(rows, lefts, rights))
+
+
+def _write_sub_highlights(writer: Writer, highlights: List[SubHighlight]) -> None:
+    writer.ints([value for triple in highlights for value in triple])
+
+
+def _read_sub_highlights(reader: Reader) -> List[SubHighlight]:
+    flat = reader.ints()
+    return list(zip(flat[0::3], flat[1::3], flat[2::3]))
+
+
+def _write_spans(writer: Writer, spans: Sequence[Span]) -> None:
+    writer.ints([value for span in spans for value in span])
+
+
+def _read_spans(reader: Reader) -> List[Span]:
+    flat = reader.ints()
+    return list(zip(flat[0::2], flat[1::2]))
+
+
+def encode_diff_request(
+    view1_contents: str,
+    view2_contents: str,
+    options: Options,
+    pieces: Optional[Tuple[int, int, int]] = None
+) -> bytes:
+    """Encode a diff request, `pieces` are the sizes to stream the pieces in, if any."""
+    writer = Writer().json(options).ints(pieces or ())
+    return writer.text(view1_contents).text(view2_contents).getvalue()
+
+
+def decode_diff_request(
+    payload: bytes
+) -> Tuple[str, str, Options, Optional[Tuple[int, int, int]]]:
+    reader = Reader(payload)
+    options = reader.json()
+    pieces = reader.ints()
+    return (
+        reader.text(), reader.text(), options,
+        (pieces[0], pieces[1], pieces[2]) if pieces else None
+    )
+
+
+def encode_diff_result(result: DiffResult) -> bytes:
+    writer = Writer().text(result.bufferA).text(result.bufferB)
+    writer.ints(result.highlightA).ints(result.highlightB)
+    _write_intraline_changes(writer, result.found_intraline_changes)
+    _write_spans(writer, result.regionsA)
+    _write_spans(writer, result.regionsB)
+    writer.ints(result.intraline_offsetsA).ints(result.intraline_offsetsB)
+    writer.json(result.degraded)
+    _write_spans(writer, result.movedA)
+    _write_spans(writer, result.movedB)
+    return writer.getvalue()
+
+
+def decode_diff_result(payload: bytes) -> DiffResult:
+    reader = Reader(payload)
+    return DiffResult(
+        reader.text(), reader.text(),
+        reader.ints(), reader.ints(), _read_intraline_changes(reader),
+        _read_spans(reader), _read_spans(reader),
+        reader.ints(), reader.ints(),
+        tuple(reader.json()), _read_spans(reader), _read_spans(reader),
+    )
+
+
+def encode_piece(piece: Optional[DiffPiece]) -> bytes:
+    """Encode a piece, or None for starting over, see `core.pieces.PieceStream`."""
+    if piece is None:
+        return b''
+    writer = Writer().text(piece.textA).text(piece.textB)
+    for spans in piece[2:]:
+        _write_spans(writer, spans)
+    return writer.getvalue()
+
+
+def decode_piece(payload: bytes) -> Optional[DiffPiece]:
+    if not payload:
+        return None
+    reader = Reader(payload)
+    return DiffPiece(
+        reader.text(), reader.text(),
+        _read_spans(reader), _read_spans(reader), _read_spans(reader), _read_spans(reader)
+    )
+
+
+def encode_intraline_request(changes: List[IntralineChange], options: Options) -> bytes:
+    writer = Writer().json(options)
+    _write_intraline_changes(writer, changes)
+    return writer.getvalue()
+
+
+def decode_intraline_request(payload: bytes) -> Tuple[List[IntralineChange], Options]:
+    reader = Reader(payload)
+    options = reader.json()
+    return _read_intraline_changes(reader), options
+
+
+def encode_intraline_result(
+    result: Tuple[List[SubHighlight], List[SubHighlight]]
+) -> bytes:
+    writer = Writer()
+    _write_sub_highlights(writer, result[0])
+    _write_sub_highlights(writer, result[1])
+    return writer.getvalue()
+
+
+def decode_intraline_result(payload: bytes) -> Tuple[List[SubHighlight], List[SubHighlight]]:
+    reader = Reader(payload)
+    return _read_sub_highlights(reader), _read_sub_highlights(reader)
@@ -0,0 +1,22 @@
+"""Set operations on regions given as `(a, b)` offset pairs."""
+from __future__ import annotations
+
+from typing import Iterable, List, Tuple
+
+Span = Tuple[int, int]
+
+
+def merge_spans(spans: Iterable[Span]) -> List[Span]:
+    """Return the union of `spans` as sorted, disjoint `(begin, end)` spans.
+
+    Overlapping and touching spans are merged, so are chains of them.
+    Spans may be reversed, i.e. `a > b`.
+    """
+    merged: List[Span] = []
+    for begin, end in sorted((a, b) if a <= b else (b, a) for a, b in spans):
+        if merged and begin <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((begin, end))
+    return merged
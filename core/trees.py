@@ -0,0 +1,100 @@
+"""Compare two directory trees file by file.
+
+Files with the same size and modification time are taken as unchanged.
+Only the others with the same size are hashed, in a pool of threads;
+hashing releases the GIL, so they really work in parallel.
+"""
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from .files import file_digest
+
+# relative path -> (size, mtime in ns)
+FileStats = Dict[str, Tuple[int, int]]
+
+
+class TreeDiff(NamedTuple):
+    # relative paths, sorted
+    added: List[str]
+    removed: List[str]
+    changed: List[str]
+    unchanged: int
+
+
+def walk(root: str) -> FileStats:
+    """Return the files below `root`, without following links to directories."""
+    files: FileStats = {}
+    pending = ['']
+    while pending:
+        prefix = pending.pop()
+        try:
+            with os.scandir(os.path.join(root, prefix)) as entries:
+                for entry in entries:
+                    path = prefix + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(path + os.sep)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        files[path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError as e:
+            print(f"Compare Error: could not list {os.path.join(root, prefix)}.\n{e}")
+    return files
+
+
+def compare_trees(
+    rootA: str,
+    rootB: str,
+    max_workers: Optional[int] = None,
+    on_progress: Optional[Callable[[float], None]] = None
+) -> TreeDiff:
+    # `on_progress` is called with the fraction of the files to hash which
+    # are done.  It may raise to abort the comparison.
+    if on_progress is None:
+        on_progress = lambda progress: None
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        filesA, filesB = pool.map(walk, (rootA, rootB))
+        added = sorted(filesB.keys() - filesA.keys())
+        removed = sorted(filesA.keys() - filesB.keys())
+        changed = []
+        unchanged = 0
+        suspects = []
+        for path in filesA.keys() & filesB.keys():
+            (sizeA, mtimeA), (sizeB, mtimeB) = filesA[path], filesB[path]
+            if sizeA != sizeB:
+                changed.append(path)
+            elif mtimeA == mtimeB:
+                unchanged += 1
+            else:
+                suspects.append(path)
+
+        digests: List[Tuple[str, Future, Future]] = [
+            (
+                path,
+                pool.submit(file_digest, os.path.join(rootA, path)),
+                pool.submit(file_digest, os.path.join(rootB, path))
+            )
+            for path in suspects
+        ]
+        try:
+            for n, (path, digestA, digestB) in enumerate(digests):
+                on_progress(n / len(digests))
+                try:
+                    same = digestA.result() == digestB.result()
+                except OSError:
+                    same = False
+                if same:
+                    unchanged += 1
+                else:
+                    changed.append(path)
+        except BaseException:
+            for _, digestA, digestB in digests:
+                digestA.cancel()
+                digestB.cancel()
+            raise
+
+    changed.sort()
+    return TreeDiff(added, removed, changed, unchanged)
@@ -0,0 +1,73 @@
+"""Entry point of a diff worker process, run as `python -m core.worker`.
+
+Announces itself with a READY frame, then reads request frames from
+stdin and answers each with any number of PROGRESS frames, and PIECE
+frames if the request asks for them, followed by exactly one RESULT or
+ERROR frame.
+"""
+from __future__ import annotations
+import sys
+import time
+import traceback
+
+from . import protocol
+from .diff import compute_diff, compute_intraline_differences
+from .pieces import DiffPiece, PieceStream
+
+PROGRESS_INTERVAL = 0.05
+
+
+def main() -> None:
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    # Stray prints must not end up in our binary stream.
+    sys.stdout = sys.stderr
+    protocol.write_frame(stdout, protocol.READY, protocol.VERSION.pack(*sys.version_info[:2]))
+
+    last_report = 0.0
+
+    def on_progress(progress: float) -> None:
+        nonlocal last_report
+        now = time.perf_counter()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            protocol.write_frame(
+                stdout, protocol.PROGRESS, protocol.PROGRESS_VALUE.pack(progress)
+            )
+
+    def send_piece(piece: DiffPiece | None) -> None:
+        protocol.write_frame(stdout, protocol.PIECE, protocol.encode_piece(piece))
+
+    while True:
+        frame = protocol.read_frame(stdin)
+        if frame is None:
+            return
+        kind, payload = frame
+        try:
+            if kind == protocol.DIFF:
+                view1_contents, view2_contents, options, pieces = (
+                    protocol.decode_diff_request(payload)
+                )
+                del payload
+                stream = PieceStream(send_piece, *pieces) if pieces else None
+                result = protocol.encode_diff_result(compute_diff(
+                    view1_contents, view2_contents, options, on_progress, stream=stream
+                ))
+            elif kind == protocol.INTRALINE:
+                changes, options = protocol.decode_intraline_request(payload)
+                del payload
+                result = protocol.encode_intraline_result(
+                    compute_intraline_differences(changes, options)
+                )
+            else:
+                raise ValueError(f"unknown request kind {kind}")
+        except Exception:
+            protocol.write_frame(
+                stdout, protocol.ERROR, traceback.format_exc().encode('utf-8')
+            )
+        else:
+            protocol.write_frame(stdout, protocol.RESULT, result)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,256 @@
 from __future__ import annotations
+from bisect import bisect_left, bisect_right
 from collections import deque
-import difflib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import partial
-from itertools import chain, tee
+import cProfile
+from itertools import count
+import io
 import os
-import re
+import pstats
+import shutil
 import threading
+import time
+
+from typing import Iterator
 
 import sublime
 import sublime_plugin
 
-from typing import Iterable, TypeVar
-T = TypeVar("T")
+from .core import protocol
+from .core.alignment import PADDING, Alignment, padding_edits, rows_flags
+from .core.budget import BUDGET_KEYS
+from .core.cache import ResultCache, diff_key, intraline_key
+from .core.context import Folds, Shifts, collapse
+from .core.diff import DiffResult, compute_diff, compute_intraline_differences
+from .core.files import FALLBACK_ENCODING, python_encoding, read_manifest, read_text
+from .core.hunks import HunkIndex
+from .core.metrics import Metrics, maybe_phase, maybe_piece
+from .core.pieces import DiffPiece, PieceStream, iter_pieces
+from .core.precheck import BINARY, IDENTICAL, SAME_TEXT, file_verdict, text_verdict
+from .core.trees import TreeDiff, compare_trees
+from .core.regions import merge_spans
+from .core.pool import WorkerError, WorkerPool
+
+
+def sbs_settings():
+    return sublime.load_settings('SBSCompare.sublime-settings')
+
 
+DIFF_OPTIONS = (
+    'ignore_pattern',
+    'ignore_whitespace',
+    'ignore_case',
+    'diff_algorithm',
+    'intraline_emptyspace',
+    'intraline_token_limit',
+    'intraline_line_limit',
+    'intraline_refine_limit',
+    'moved_min_lines',
+) + BUDGET_KEYS
+
+
+# A snapshot of the DIFF_OPTIONS, dropped whenever the settings change.
+# `core.diff` keeps the line normalizer built from it.
+cached_diff_options: dict | None = None
+
+
+def diff_options():
+    global cached_diff_options
+    if cached_diff_options is None:
+        settings = sbs_settings()
+        cached_diff_options = {
+            key: settings.get(key) for key in DIFF_OPTIONS if settings.has(key)
+        }
+    return cached_diff_options
 
-# (c) @rhettinger on GitHub
-def triplewise(iterable: Iterable[T]) -> Iterable[tuple[T, T, T]]:
-    """Return overlapping triplets from *iterable*.
 
-    >>> list(triplewise('ABCDE'))
-    [('A', 'B', 'C'), ('B', 'C', 'D'), ('C', 'D', 'E')]
+def on_settings_changed():
+    global cached_diff_options
+    cached_diff_options = None
 
+
+def plugin_loaded():
+    sbs_settings().add_on_change('sbs_compare', on_settings_changed)
+
+
+worker_pool: WorkerPool | None = None
+worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool(input_size: int, batch: bool = False) -> WorkerPool | None:
+    """Return the worker pool if `input_size` characters are worth it.
+
+    A `batch` of diffs always is: threads diffing in-process would just
+    take turns holding the GIL.
     """
-    # This deviates from the itertools documentation reciple - see
-    # https://github.com/more-itertools/more-itertools/issues/889
-    t1, t2, t3 = tee(iterable, 3)
-    next(t3, None)
-    next(t3, None)
-    next(t2, None)
-    return zip(t1, t2, t3)
+    global worker_pool
+    settings = sbs_settings()
+    size = settings.get('worker_processes', 4)
+    if not size or (not batch and input_size < settings.get('worker_threshold', 1000000)):
+        return None
+    python = (
+        settings.get('worker_python')
+        or shutil.which('python3')
+        or shutil.which('python')
+    )
+    if not python:
+        return None
 
+    with worker_pool_lock:
+        if worker_pool and (worker_pool.python, worker_pool.size) != (python, size):
+            worker_pool.shutdown()
+            worker_pool = None
+        if worker_pool is None:
+            worker_pool = WorkerPool(python, size)
+        # Once `python` failed to run a worker, diff in-process until
+        # another one is configured.
+        return None if worker_pool.failure else worker_pool
 
-def sbs_settings():
-    return sublime.load_settings('SBSCompare.sublime-settings')
+
+def plugin_unloaded():
+    sbs_settings().clear_on_change('sbs_compare')
+    if worker_pool:
+        worker_pool.shutdown()
+
+
+result_cache: ResultCache | None = None
+result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache | None:
+    global result_cache
+    settings = sbs_settings()
+    max_size = settings.get('result_cache_size', 64) * 2**20
+    directory = (
+        os.path.join(sublime.cache_path(), 'SBSCompare', 'results')
+        if settings.get('result_cache_persist', False) else None
+    )
+    max_disk_size = settings.get('result_cache_disk_size', 256) * 2**20
+    if not max_size and not directory:
+        return None
+
+    with result_cache_lock:
+        config = (max_size, directory, max_disk_size)
+        if (
+            result_cache is None
+            or (result_cache.max_size, result_cache.directory, result_cache.max_disk_size) != config
+        ):
+            result_cache = ResultCache(*config)
+        return result_cache
+
+
+def run_compute_diff(
+    view1_contents, view2_contents, on_progress, metrics=None, in_process=False, batch=False,
+    stream=None
+):
+    # Diffs being computed feed the `stream`, cached ones are complete at once.
+    options = diff_options()
+    input_chars = len(view1_contents) + len(view2_contents)
+    with maybe_phase(metrics, 'diff', input_chars=input_chars, source='cache') as record:
+        cache = get_result_cache()
+        if in_process:
+            record['source'] = 'in-process'
+            result = compute_diff(
+                view1_contents, view2_contents, options, on_progress, metrics, stream
+            )
+        elif not cache:
+            result = _run_compute_diff(
+                view1_contents, view2_contents, options, on_progress, record, metrics, batch,
+                stream
+            )
+        else:
+            result = cache.cached(
+                diff_key(view1_contents, view2_contents, options),
+                lambda: _run_compute_diff(
+                    view1_contents, view2_contents, options, on_progress, record, metrics, batch,
+                    stream
+                ),
+                protocol.encode_diff_result,
+                protocol.decode_diff_result,
+                # They depend on the budgets, and on how busy we are.
+                keep=lambda result: not result.degraded
+            )
+        record.update(
+            regionsA=len(result.regionsA),
+            regionsB=len(result.regionsB),
+            intraline_changes=len(result.found_intraline_changes),
+        )
+        return result
+
+
+def _run_compute_diff(
+    view1_contents, view2_contents, options, on_progress, record, metrics, batch=False,
+    stream=None
+):
+    pool = get_worker_pool(len(view1_contents) + len(view2_contents), batch)
+    if pool:
+        try:
+            result = pool.compute_diff(
+                view1_contents, view2_contents, options, on_progress, stream
+            )
+            record['source'] = 'worker'
+            return result
+        except (OSError, WorkerError) as e:
+            print(f"Compare Error: diff worker failed, diffing in-process instead.\n{e}")
+    record['source'] = 'in-process'
+    return compute_diff(view1_contents, view2_contents, options, on_progress, metrics, stream)
+
+
+def run_compute_intraline_differences(found_intraline_changes):
+    options = diff_options()
+    cache = get_result_cache()
+    if not cache:
+        return _run_compute_intraline_differences(found_intraline_changes, options)
+    return cache.cached(
+        intraline_key(found_intraline_changes, options),
+        lambda: _run_compute_intraline_differences(found_intraline_changes, options),
+        protocol.encode_intraline_result,
+        protocol.decode_intraline_result
+    )
+
+
+def _run_compute_intraline_differences(found_intraline_changes, options):
+    pool = get_worker_pool(
+        sum(len(left) + len(right) for _, left, right in found_intraline_changes)
+    )
+    if pool:
+        try:
+            return pool.compute_intraline_differences(found_intraline_changes, options)
+        except (OSError, WorkerError) as e:
+            print(f"Compare Error: diff worker failed, diffing in-process instead.\n{e}")
+    return compute_intraline_differences(found_intraline_changes, options)
+
+
+# Large texts are not passed as command arguments, which Sublime would
+# serialize to JSON and back, but stashed here under a token.
+pending_payloads: dict[int, str] = {}
+payload_tokens = count()
+
+
+def stash_payload(text: str) -> int:
+    token = next(payload_tokens)
+    pending_payloads[token] = text
+    return token
 
 
 class sbs_replace_view_contents(sublime_plugin.TextCommand):
-    def run(self, edit, text):
+    def run(self, edit, text=None, token=None, append=False, region=None):
+        if token is not None:
+            text = pending_payloads.pop(token)
         view = self.view
+        if region is not None:
+            region = sublime.Region(*region)
+        elif append:
+            region = sublime.Region(view.size())
+        else:
+            region = sublime.Region(0, view.size())
         if view.is_read_only():
             view.set_read_only(False)
-            view.replace(edit, sublime.Region(0, view.size()), text)
+            view.replace(edit, region, text)
             view.set_read_only(True)
         else:
-            view.replace(edit, sublime.Region(0, view.size()), text)
+            view.replace(edit, region, text)
 
 
 class SbsLayoutPreserver(sublime_plugin.EventListener):
@@ -69,9 +276,19 @@ class SbsLayoutPreserver(sublime_plugin.EventListener):
         }
 
     def on_pre_close(self, view):
+        report_entries.pop(view.id(), None)
         # if one comparison view is closed, close the other
         if view.settings().get('is_sbs_compare'):
             win = view.window()
+            if win and (job := running_jobs.pop(win.id(), None)):
+                job.cancel()
+            if win:
+                hunk_indexes.pop(win.id(), None)
+                folded_comparisons.pop(win.id(), None)
+                if colorizer := intraline_colorizers.pop(win.id(), None):
+                    colorizer.cancel()
+                if live := live_diffs.get(win.id()):
+                    live.stop()
             sublime.set_timeout(lambda: win.run_command('close_window'), 10)
             return
 
@@ -123,8 +340,10 @@ class sbs_mark_sel(sublime_plugin.TextCommand):
 
 
 class sbs_compare_files(sublime_plugin.ApplicationCommand):
-    def run(self, A=None, B=None):
-        global sbs_files
+    def run(self, A=None, B=None, pairs=None, manifest=None):
+        if pairs is not None or manifest is not None:
+            self.run_batch(pairs or [], manifest)
+            return
 
         if A is None or B is None:
             print('Compare Error: file(s) not specified')
@@ -136,17 +355,312 @@ class sbs_compare_files(sublime_plugin.ApplicationCommand):
             print('Compare Error: file(s) not found: %s, %s' % (A, B))
             return
 
+        # Check for identical files first, without blocking the UI.
+        threading.Thread(
+            target=partial(self.check_verdict, A, B, fallback_encoding())
+        ).start()
+
+    def run_batch(self, pairs, manifest):
+        pairs = [(os.path.abspath(A), os.path.abspath(B)) for A, B in pairs]
+        if manifest is not None:
+            try:
+                pairs += read_manifest(manifest)
+            except (OSError, ValueError) as e:
+                print(f"Compare Error: could not read the manifest.\n{e}")
+                return
+        if not pairs:
+            print('Compare Error: no files to compare')
+            return
+
+        print('Comparing %d pairs of files' % len(pairs))
+        BatchCompareJob(sublime.active_window(), pairs).start()
+
+    def check_verdict(self, A, B, fallback):
+        try:
+            verdict = file_verdict(A, B, fallback)
+        except OSError as e:
+            print(f"Compare Error: could not read the files.\n{e}")
+            return
+        sublime.set_timeout(partial(self.compare, A, B, verdict))
+
+    def compare(self, A, B, verdict):
+        global sbs_files
+
+        window = sublime.active_window()
+        if verdict:
+            message = VERDICTS[verdict].format('Files')
+            print('%s: "%s" and "%s"' % (message, A, B))
+            window.status_message(message)
+            return
+
         sbs_files = [A, B]
         print('Comparing "%s" and "%s"' % (A, B))
+        window.run_command('sbs_compare')
+
 
+class sbs_compare_directories(sublime_plugin.ApplicationCommand):
+    def run(self, A=None, B=None):
         window = sublime.active_window()
-        window.run_command('sbs_compare')
+        if A is None:
+            folders = window.folders()
+            window.show_input_panel(
+                'Compare directory:', folders[0] if folders else '',
+                lambda A: self.run(A, B), None, None
+            )
+            return
+        if B is None:
+            window.show_input_panel(
+                f'Compare {A} with directory:', '', lambda B: self.run(A, B), None, None
+            )
+            return
+
+        A = os.path.abspath(A)
+        B = os.path.abspath(B)
+        if not os.path.isdir(A) or not os.path.isdir(B):
+            print('Compare Error: directory(s) not found: %s, %s' % (A, B))
+            return
+
+        print('Comparing directories "%s" and "%s"' % (A, B))
+        DirectoryCompareJob(window, A, B).start()
+
+
+class DirectoryCompareJob:
+    """Compare two directory trees in a worker thread, then show the results."""
+    def __init__(self, window, dirA, dirB):
+        self.window = window
+        self.dirA = dirA
+        self.dirB = dirB
+        self.done = False
+        self.progress = 0.0
+
+    def start(self):
+        threading.Thread(target=self.run).start()
+        show_spinner(
+            self.window.status_message,
+            lambda: f"comparing directories… {self.progress:.0%}",
+            lambda: not self.done and self.window.is_valid()
+        )
+
+    def checkpoint(self, progress: float):
+        self.progress = progress
+
+    def run(self):
+        try:
+            diff = compare_trees(
+                self.dirA, self.dirB,
+                sbs_settings().get('directory_compare_threads') or None,
+                self.checkpoint
+            )
+        except Exception as e:
+            print(f"Compare Error: could not compare the directories.\n{e}")
+            sublime.set_timeout(
+                partial(self.window.status_message, 'Could not compare the directories')
+            )
+            return
+        finally:
+            self.done = True
+        sublime.set_timeout(
+            partial(show_directory_results, self.window, self.dirA, self.dirB, diff)
+        )
+
+
+# report view id -> row -> (file in A, file in B), either may be None
+report_entries: dict[int, dict[int, tuple[str | None, str | None]]] = {}
+
+
+def show_report(window, name, lines, entries):
+    """Show `lines` in a new view, the rows of its `entries` open them."""
+    if not window.is_valid():
+        window = sublime.active_window()
+    view = window.new_file()
+    view.set_name(name)
+    view.set_scratch(True)
+    view.settings().set('is_sbs_report', True)
+    view.settings().set('word_wrap', False)
+    view.run_command('sbs_replace_view_contents', {'token': stash_payload('\n'.join(lines))})
+    view.set_read_only(True)
+    report_entries[view.id()] = entries
+    window.status_message('Press enter on an entry to open it')
+
+
+def show_directory_results(window, dirA, dirB, diff: TreeDiff):
+    lines = [
+        f'Comparing {dirA}',
+        f'     with {dirB}',
+        f'{len(diff.changed)} changed, {len(diff.removed)} removed, '
+        f'{len(diff.added)} added, {diff.unchanged} unchanged files',
+        '',
+    ]
+    entries: dict[int, tuple[str | None, str | None]] = {}
+    for title, marker, paths in (
+        ('Changed', 'M', diff.changed),
+        ('Removed, only in the first directory', '-', diff.removed),
+        ('Added, only in the second directory', '+', diff.added),
+    ):
+        if not paths:
+            continue
+        lines.append(f'{title} ({len(paths)}):')
+        for path in paths:
+            entries[len(lines)] = (
+                None if marker == '+' else os.path.join(dirA, path),
+                None if marker == '-' else os.path.join(dirB, path),
+            )
+            lines.append(f'  {marker} {path}')
+        lines.append('')
+
+    show_report(
+        window, f'Compare: {os.path.basename(dirA)} ↔ {os.path.basename(dirB)}', lines, entries
+    )
+
+
+class BatchCompareJob:
+    """Compare many pairs of files concurrently, then report their differences.
+
+    No comparison views are built, the report opens them on demand.
+    The pairs are diffed in the worker processes, and all results end up
+    in the result cache, so opening them later is quick.
+    """
+    def __init__(self, window, pairs):
+        self.window = window
+        self.pairs = pairs
+        self.finished = 0
+        self.done = False
+        self.fallback = fallback_encoding()
+
+    def start(self):
+        threading.Thread(target=self.run).start()
+        show_spinner(
+            self.window.status_message,
+            lambda: f"comparing files… {self.finished} of {len(self.pairs)}",
+            lambda: not self.done and self.window.is_valid()
+        )
+
+    def run(self):
+        threads = sbs_settings().get('worker_processes', 4) or 1
+        try:
+            with ThreadPoolExecutor(threads) as pool:
+                futures = [pool.submit(self.compare, pair) for pair in self.pairs]
+                for _ in as_completed(futures):
+                    self.finished += 1
+            outcomes = [future.result() for future in futures]
+        finally:
+            self.done = True
+        sublime.set_timeout(partial(self.report, outcomes))
+
+    def compare(self, pair):
+        """Return the counts of modified, removed and added lines, a verdict, or an error."""
+        fileA, fileB = pair
+        try:
+            verdict = file_verdict(fileA, fileB, self.fallback)
+            if verdict == IDENTICAL:
+                return 0, 0, 0
+            if verdict:
+                return verdict
+            result = run_compute_diff(
+                read_text(fileA, fallback=self.fallback),
+                read_text(fileB, fallback=self.fallback),
+                lambda progress: None,
+                batch=True
+            )
+        except Exception as e:
+            return e
+        return change_counts(result)
+
+    def report(self, outcomes):
+        failed = sum(1 for outcome in outcomes if isinstance(outcome, Exception))
+        binary = outcomes.count(BINARY)
+        same_text = outcomes.count(SAME_TEXT)
+        unchanged = outcomes.count((0, 0, 0))
+        changed = len(outcomes) - failed - binary - same_text - unchanged
+        lines = [
+            f'Compared {len(self.pairs)} pairs of files: {changed} changed, '
+            f'{binary} binary and different, {same_text} different in line endings or '
+            f'encoding only, {unchanged} unchanged, {failed} failed',
+            '',
+            'modified  removed    added',
+        ]
+        entries: dict[int, tuple[str | None, str | None]] = {}
+        for (fileA, fileB), outcome in zip(self.pairs, outcomes):
+            entries[len(lines)] = (fileA, fileB)
+            if isinstance(outcome, Exception):
+                counts = f'{"failed":>26}'
+            elif isinstance(outcome, str):
+                counts = f'{VERDICT_LABELS[outcome]:>26}'
+            elif outcome == (0, 0, 0):
+                counts = f'{"unchanged":>26}'
+            else:
+                counts = '{:>8} {:>8} {:>8}'.format(*outcome)
+            lines.append(f'{counts}  {fileA}  ↔  {fileB}')
+            if isinstance(outcome, Exception):
+                lines.append(f'{"":>28}{outcome}')
+        show_report(self.window, f'Compare: {len(self.pairs)} pairs', lines, entries)
+
+
+class sbs_open_report_entry(sublime_plugin.TextCommand):
+    """Compare the pairs of files under the cursors, or open a lone file."""
+    def is_visible(self):
+        return self.view.id() in report_entries
+
+    def run(self, edit):
+        entries = report_entries.get(self.view.id())
+        if entries is None:
+            return
+        for region in self.view.sel():
+            entry = entries.get(self.view.rowcol(region.b)[0])
+            if entry is None:
+                continue
+            fileA, fileB = entry
+            if fileA and fileB:
+                # Diffs are cached by content, so revisiting an entry is quick.
+                sublime.run_command('sbs_compare_files', {'A': fileA, 'B': fileB})
+            elif window := self.view.window():
+                window.open_file(fileA or fileB)
+
+
+def fallback_encoding() -> str:
+    """Return the codec of Sublime's "fallback_encoding", for files which aren't UTF-8."""
+    name = sublime.load_settings('Preferences.sublime-settings').get('fallback_encoding')
+    return python_encoding(name) or FALLBACK_ENCODING
 
 
 def get_view_contents(view):
     return view.substr(sublime.Region(0, view.size()))
 
 
+# Inputs with one of these verdicts are not diffed, see `core.precheck`.
+VERDICTS = {
+    IDENTICAL: '{} are identical',
+    BINARY: 'Binary {} differ',
+    SAME_TEXT: '{} differ only in line endings or encoding',
+}
+VERDICT_LABELS = {BINARY: 'binary, differ', SAME_TEXT: 'line endings only'}
+
+
+def views_verdict(view1, view2, view1_contents, view2_contents):
+    """Return the verdict on the contents of two views, or None if they need a diff."""
+    # Sublime shows binary files as a hex dump.
+    if 'Hexadecimal' in (view1.encoding(), view2.encoding()):
+        return IDENTICAL if view1_contents == view2_contents else BINARY
+    verdict = text_verdict(view1_contents, view2_contents)
+    if verdict == IDENTICAL and (
+        (view1.line_endings(), view1.encoding()) != (view2.line_endings(), view2.encoding())
+    ):
+        return SAME_TEXT
+    return verdict
+
+
+def change_counts(result: DiffResult) -> tuple[int, int, int]:
+    """Return the numbers of modified, removed and added lines."""
+    # The rows changed on both sides, the budget may have dropped some
+    # of them from `found_intraline_changes`.
+    modified = len(set(result.highlightA).intersection(result.highlightB))
+    return modified, len(result.highlightA) - modified, len(result.highlightB) - modified
+
+
+def merge_regions(regions):
+    return [sublime.Region(a, b) for a, b in merge_spans((r.a, r.b) for r in regions)]
+
+
 def get_drawtype():
     return (
         sublime.DRAW_OUTLINED
@@ -199,6 +713,7 @@ class sbs_compare(sublime_plugin.TextCommand):
             syntax,
             name1_override=False,
             name2_override=False,
+            files=None,
         ):
             view1_syntax = syntax
             view2_syntax = syntax
@@ -286,7 +801,10 @@ class sbs_compare(sublime_plugin.TextCommand):
             new_window.set_view_index(view1, 0, 0)
             new_window.set_view_index(view2, 1, 0)
 
-            compare_views(view1, view2, view1_contents, view2_contents)
+            if files:
+                FileCompareJob(view1, view2, *files).start()
+            else:
+                compare_views(view1, view2, view1_contents, view2_contents)
             ViewScrollSyncer(new_window, [view1, view2])
 
             # focus first view
@@ -297,6 +815,11 @@ class sbs_compare(sublime_plugin.TextCommand):
                 # get original views' data
                 view1_contents = get_view_contents(active_view)
                 view2_contents = get_view_contents(openTabs[index][1])
+                if verdict := views_verdict(
+                    active_view, openTabs[index][1], view1_contents, view2_contents
+                ):
+                    active_window.status_message(VERDICTS[verdict].format('Tabs'))
+                    return
 
                 syntax = active_view.settings().get('syntax')
 
@@ -304,28 +827,15 @@ class sbs_compare(sublime_plugin.TextCommand):
                     view1_contents, view2_contents, syntax, False, openTabs[index][0]
                 )
 
-        def compare_from_views(view1, view2):
-            if view1.is_loading() or view2.is_loading():
-                sublime.set_timeout(lambda: compare_from_views(view1, view2), 10)
-            else:
-                view1_contents = get_view_contents(view1)
-                view2_contents = get_view_contents(view2)
-                syntax = view1.settings().get('syntax')
-
-                view1.close()
-                view2.close()
-
-                create_comparison(view1_contents, view2_contents, syntax, file1, file2)
-
         if len(sbs_files) > 0:
-            file1 = sbs_files[0]
-            file2 = sbs_files[1]
-
-            view1 = active_window.open_file(file1)
-            view2 = active_window.open_file(file2)
-
-            compare_from_views(view1, view2)
+            file1, file2 = sbs_files
             del sbs_files[:]
+
+            # The files are read in the worker thread, straight from disk.
+            syntax = sublime.find_syntax_for_file(file1)
+            create_comparison(
+                '', '', syntax.path if syntax else None, file1, file2, files=(file1, file2)
+            )
         elif compare_selections is True:
             sel = active_view.sel()
 
@@ -339,6 +849,9 @@ class sbs_compare(sublime_plugin.TextCommand):
                     selA, selB = selB, active_view.substr(sel[0])
                 sbs_markedSelection = ['', '']
 
+            if verdict := text_verdict(selA, selB):
+                active_window.status_message(VERDICTS[verdict].format('Selections'))
+                return
             syntax = active_view.settings().get('syntax')
             create_comparison(selA, selB, syntax, 'selection A', 'selection B')
         elif len(openTabs) == 1:
@@ -376,31 +889,386 @@ class sbs_compare(sublime_plugin.TextCommand):
                 )
 
 
+class Cancelled(Exception):
+    pass
+
+
+def new_metrics(view1, view2) -> Metrics | None:
+    settings = sbs_settings()
+    if not settings.get('metrics'):
+        return None
+    return Metrics(f"{view1.name()} | {view2.name()}", settings.get('metrics_memory', False))
+
+
+def report_metrics(metrics: Metrics | None, views):
+    """Report the `metrics` as the "metrics" setting says, once."""
+    if metrics is None or metrics.reported:
+        return
+    metrics.reported = True
+    metrics.close()
+    settings = sbs_settings()
+    targets = settings.get('metrics')
+    if isinstance(targets, str):
+        targets = [targets]
+    summary = metrics.summary()
+    if 'console' in targets:
+        print(f"Compare metrics: {metrics.label}: {summary}")
+        for record in metrics.report()['phases']:
+            details = ', '.join(
+                f"{key} {value}" for key, value in record.items() if key != 'phase'
+            )
+            print(f"  {record['phase']}: {details}")
+    if 'status' in targets:
+        for view in views:
+            if view.is_valid():
+                view.set_status('sbs_metrics', summary)
+    if 'log' in targets:
+        path = settings.get('metrics_log') or os.path.join(
+            sublime.cache_path(), 'SBSCompare', 'metrics.jsonl'
+        )
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            metrics.append_to(path)
+        except OSError as e:
+            print(f"Compare Error: could not write the metrics log.\n{e}")
+
+
+# Set by `sbs_profile_next_compare`, taken by the next comparison.
+profile_next_compare = False
+
+
+def report_profile(profiler: cProfile.Profile):
+    path = os.path.join(sublime.cache_path(), 'SBSCompare', 'compare.prof')
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(30)
+    print(f"Compare profile:\n{stream.getvalue()}")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profiler.dump_stats(path)
+    except OSError as e:
+        print(f"Compare Error: could not save the profile.\n{e}")
+    else:
+        print(f"Compare profile saved to {path}")
+
+
+class sbs_profile_next_compare(sublime_plugin.ApplicationCommand):
+    """Run the next comparison under cProfile, and print the profile.
+
+    Only the worker thread of the comparison, reading and diffing, is
+    profiled.  It diffs in-process, skipping the cache and the worker
+    processes.
+    """
+    def run(self):
+        global profile_next_compare
+        profile_next_compare = True
+        sublime.status_message('The next comparison will be profiled')
+
+
+# window id -> the job computing the comparison shown in that window
+running_jobs: dict[int, CompareJob] = {}
+SPINNER = '⣾⣽⣻⢿⡿⣟⣯⣷'
+
+
+def show_spinner(show, message, running, stopped=None, tick=0):
+    """Pass `message()` behind a spinner to `show` every 100ms while `running()`.
+
+    Then call `stopped`, if given.
+    """
+    if not running():
+        if stopped:
+            stopped()
+        return
+    show(f"{SPINNER[tick % len(SPINNER)]} {message()}")
+    sublime.set_timeout(partial(show_spinner, show, message, running, stopped, tick + 1), 100)
+
+
+class CompareJob:
+    """Compute a comparison in a worker thread.
+
+    The views are filled in on the main thread, already while the diff
+    is assembled, see `ViewFiller`.  Closing the comparison window, or
+    starting another compare in it, cancels the job at its next
+    checkpoint.  Comparisons in other windows run on in parallel.
+    """
+    def __init__(self, view1, view2, view1_contents, view2_contents):
+        self.view1 = view1
+        self.view2 = view2
+        self.view1_contents = view1_contents
+        self.view2_contents = view2_contents
+        self.window_id = view1.window().id()
+        self.cancelled = threading.Event()
+        self.error = ''
+        self.done = False
+        self.progress = 0.0
+        self.metrics = new_metrics(view1, view2)
+        self.filler = ViewFiller(view1, view2, self.metrics, self.cancelled)
+        global profile_next_compare
+        self.profiling, profile_next_compare = profile_next_compare, False
+
+    def start(self):
+        if job := running_jobs.get(self.window_id):
+            job.cancel()
+        running_jobs[self.window_id] = self
+        threading.Thread(target=self.run).start()
+        show_spinner(
+            self.set_status,
+            lambda: f"computing… {self.progress:.0%}",
+            lambda: not (self.cancelled.is_set() or self.done),
+            self.show_outcome
+        )
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def checkpoint(self, progress: float):
+        if self.cancelled.is_set():
+            raise Cancelled()
+        self.progress = progress
+
+    def read_inputs(self) -> tuple[str, str]:
+        return self.view1_contents, self.view2_contents
+
+    def run(self):
+        if not self.profiling:
+            self.compute()
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            self.compute()
+        finally:
+            profiler.disable()
+            report_profile(profiler)
+
+    def compute(self):
+        context = sbs_settings().get('context_lines')
+        collapsing = isinstance(context, int) and context >= 0
+        try:
+            view1_contents, view2_contents = self.read_inputs()
+            self.view1_contents = self.view2_contents = ''
+            result = run_compute_diff(
+                view1_contents, view2_contents, self.checkpoint, self.metrics, self.profiling,
+                # Collapsing changes the rows, so it needs the whole diff.
+                stream=None if collapsing else self.filler.stream()
+            )
+            del view1_contents, view2_contents
+            folds = None
+            if collapsing:
+                with maybe_phase(self.metrics, 'collapse'):
+                    result, folds = collapse(result, context)
+        except Cancelled:
+            if self.metrics:
+                self.metrics.close()
+            return
+        except Exception as e:
+            print(f"Compare Error: could not compare the views.\n{e}")
+            self.error = 'could not compare the views'
+            self.cancel()
+            if self.metrics:
+                self.metrics.close()
+            return
+        finally:
+            self.done = True
+        sublime.set_timeout(partial(self.finish, result, folds))
+
+    def finish(self, result, folds):
+        if running_jobs.get(self.window_id) is self:
+            del running_jobs[self.window_id]
+        if self.cancelled.is_set() or not (self.view1.is_valid() and self.view2.is_valid()):
+            if self.metrics:
+                self.metrics.close()
+            return
+        self.filler.finish(result, folds)
+
+    def set_status(self, message):
+        for view in (self.view1, self.view2):
+            view.set_status('sbs_compare', message)
+
+    def show_outcome(self):
+        if self.cancelled.is_set():
+            self.set_status(self.error or 'comparison cancelled')
+            return
+        for view in (self.view1, self.view2):
+            view.erase_status('sbs_compare')
+
+
+class FileCompareJob(CompareJob):
+    """Compare two files, reading them in the worker thread as well."""
+    def __init__(self, view1, view2, file1, file2):
+        super().__init__(view1, view2, '', '')
+        self.files = (file1, file2)
+        self.fallback = fallback_encoding()
+
+    def read_inputs(self):
+        try:
+            with maybe_phase(self.metrics, 'read') as record:
+                texts = tuple(
+                    read_text(path, lambda progress: self.checkpoint(0.0), self.fallback)
+                    for path in self.files
+                )
+                record['chars'] = sum(map(len, texts))
+                return texts
+        except (OSError, ValueError) as e:
+            print(f"Compare Error: could not read the files.\n{e}")
+            self.error = 'could not read the files'
+            self.cancel()
+            raise Cancelled()
+
+
 def compare_views(
     view1: sublime.View,
     view2: sublime.View,
     view1_contents: str,
     view2_contents: str
 ):
-    bufferA, bufferB, highlightA, highlightB, found_intraline_changes = \
-        compute_diff(view1_contents, view2_contents)
+    CompareJob(view1, view2, view1_contents, view2_contents).start()
+
+
+class ViewFiller:
+    """Fill the views with a diff and highlight it, piece by piece.
+
+    The first piece is just what fits on the screen, so it is drawn right
+    away.  The rest follows in growing pieces, one per tick, so the UI
+    stays responsive.  Diffs being computed `stream` their pieces while
+    they are assembled, in-process or in a worker.  Cached and collapsed
+    results are cut once they are `finish`ed.
+    """
+    def __init__(self, view1, view2, metrics=None, cancelled=None):
+        self.view1 = view1
+        self.view2 = view2
+        self.metrics = metrics
+        self.cancelled = cancelled
+        self.max_size = max(sbs_settings().get('insert_chunk_size', 4000000), 1)
+        self.first_rows = visible_rows(view1)
+        # the pieces streamed in and not drawn yet, None where the diff started over
+        self.streamed: deque[DiffPiece | None] = deque()
+        self.was_streamed = False
+        # the pieces cut from a result which was not streamed
+        self.pieces: Iterator[DiffPiece] = iter(())
+        self.result: DiffResult | None = None
+        self.folds: Folds | None = None
+        self.first = True
+        self.done = False
+        # regionsA, regionsB, movedA and movedB drawn so far
+        self.drawn: tuple[list[tuple[int, int]], ...] = ([], [], [], [])
+        self.filling = None
+
+    def stream(self) -> PieceStream:
+        """Return the stream to pass the pieces of the diff in, from any thread."""
+        return PieceStream(
+            self.push, self.first_rows, min(MIN_PIECE_SIZE, self.max_size), self.max_size
+        )
+
+    def push(self, piece: DiffPiece | None):
+        self.was_streamed = True
+        self.streamed.append(piece)
+        sublime.set_timeout(self.fill)
+
+    def finish(self, result: DiffResult, folds: Folds | None = None):
+        """Draw what is left of `result`, then highlight it."""
+        self.result, self.folds = result, folds
+        if not self.was_streamed:
+            self.pieces = iter_pieces(
+                result, self.first_rows, min(MIN_PIECE_SIZE, self.max_size), self.max_size
+            )
+        self.fill()
+
+    def fill(self):
+        if (
+            self.done
+            or (self.cancelled and self.cancelled.is_set())
+            or not (self.view1.is_valid() and self.view2.is_valid())
+        ):
+            return
+        # Every piece streamed in comes with a call.
+        if self.streamed:
+            piece = self.streamed.popleft()
+            if piece is None:
+                self.first = True
+            else:
+                self.draw(piece)
+            return
+        if self.result is None:
+            return
+        if piece := next(self.pieces, None):
+            self.draw(piece)
+            sublime.set_timeout(self.fill)
+            return
+
+        self.done = True
+        view1, view2, result = self.view1, self.view2, self.result
+        if self.filling:
+            self.filling['chars'] = len(result.bufferA) + len(result.bufferB)
+            self.metrics.end(self.filling)
+        if self.was_streamed and (result.movedA or result.movedB):
+            # The moves were found after the pieces were cut.
+            highlight_lines(view1, result.regionsA, 'A')
+            highlight_lines(view2, result.regionsB, 'B')
+            highlight_moved(view1, result.movedA, 'A')
+            highlight_moved(view2, result.movedB, 'B')
+        if self.folds:
+            show_folds(view1, view2, self.folds)
+        highlight_diff(view1, view2, result, self.metrics)
+
+    def draw(self, piece: DiffPiece):
+        view1, view2, metrics = self.view1, self.view2, self.metrics
+        first, self.first = self.first, False
+        if metrics and not self.filling:
+            self.filling = metrics.begin('fill')
+        with maybe_piece(metrics, 'first_paint' if first else 'fill_pieces') as record:
+            for view, text in ((view1, piece.textA), (view2, piece.textB)):
+                view.run_command('sbs_replace_view_contents', {
+                    'token': stash_payload(text), 'append': not first
+                })
+            # `add_regions` redraws all regions, so only touch those which grew,
+            # but replace the regions of an earlier comparison.
+            for regions, spans, view, draw, col in zip(
+                self.drawn, piece[2:], (view1, view2) * 2,
+                (highlight_lines, highlight_lines, highlight_moved, highlight_moved), 'ABAB'
+            ):
+                if first:
+                    regions.clear()
+                if spans or first:
+                    regions.extend(spans)
+                    draw(view, regions, col)
+            record['pieces'] = 1
+            if first:
+                for view in (view1, view2):
+                    view.sel().clear()
+                    view.sel().add(sublime.Region(0))
+                    view.show(0)
+                if metrics:
+                    record['since_start'] = round(time.time() - metrics.started, 4)
 
-    view1.run_command('sbs_replace_view_contents', {'text': bufferA})
-    view1.sel().clear()
-    view1.sel().add(sublime.Region(0))
-    view1.show(0)
 
-    view2.run_command('sbs_replace_view_contents', {'text': bufferB})
-    view2.sel().clear()
-    view2.sel().add(sublime.Region(0))
-    view2.show(0)
+# After the first screen, fill the views in pieces of at least this many
+# characters, doubling up to the "insert_chunk_size".
+MIN_PIECE_SIZE = 1 << 16
 
-    highlight_lines(view1, highlightA, 'A')
-    highlight_lines(view2, highlightB, 'B')
 
-    num_intra = len(found_intraline_changes)
-    num_removals = len(highlightA) - num_intra
-    num_insertions = len(highlightB) - num_intra
+def visible_rows(view) -> int:
+    """Return how many rows fit on the screen of `view`, and then some."""
+    line_height = view.line_height() or 1
+    return int(view.viewport_extent()[1] / line_height) + 10
+
+
+def highlight_diff(
+    view1: sublime.View,
+    view2: sublime.View,
+    result: DiffResult,
+    metrics: Metrics | None = None
+):
+    highlightA, highlightB, found_intraline_changes = result[2:5]
+
+    # The changed lines are highlighted while filling the views already.
+    with maybe_phase(
+        metrics, 'highlight', regionsA=len(result.regionsA), regionsB=len(result.regionsB)
+    ):
+        if window := view1.window():
+            hunks = hunk_indexes[window.id()] = HunkIndex.from_rows(highlightA, highlightB)
+            show_hunk_status((view1, view2), hunks, None)
+
+    num_intra, num_removals, num_insertions = change_counts(result)
     total = num_intra + num_removals + num_insertions
     message = (
         f"{num_intra} intra-line modifications, "
@@ -408,159 +1276,477 @@ def compare_views(
         f"{num_insertions} lines added. "
         f"{total} line differences in total."
     )
+    if result.degraded:
+        message += f" Too costly to diff fully: {'; '.join(result.degraded)}."
     if sbs_settings().get('line_count_popup', False):
         sublime.message_dialog(message)
     elif window := view1.window():
         window.status_message(message)
 
-    if sbs_settings().get('enable_intraline', True):
-        task = partial(colorize_intraline, view1, view2, found_intraline_changes)
-        threading.Thread(target=task).start()
-
-
-def compute_diff(
-    view1_contents: str, view2_contents: str
-) -> tuple[str, str, list[int], list[int], list[tuple[int, str, str]]]:
-    linesA = deque(view1_contents.splitlines(False))
-    linesB = deque(view2_contents.splitlines(False))
-
-    if sbs_settings().has('ignore_pattern'):
-        ignore_pattern = sbs_settings().get('ignore_pattern')
-        pattern = re.compile(ignore_pattern, re.MULTILINE)
-        view1_contents = pattern.sub('', view1_contents)
-        view2_contents = pattern.sub('', view2_contents)
-
-    if sbs_settings().get('ignore_whitespace', False):
-        view1_contents = re.sub(r'[ \t]', '', view1_contents)
-        view2_contents = re.sub(r'[ \t]', '', view2_contents)
-
-    if sbs_settings().get('ignore_case', False):
-        view1_contents = view1_contents.lower()
-        view2_contents = view2_contents.lower()
-
-    diffLinesA = view1_contents.splitlines(False)
-    diffLinesB = view2_contents.splitlines(False)
-
-    bufferA: list[str] = []
-    bufferB: list[str] = []
-
-    highlightA: list[int] = []
-    highlightB: list[int] = []
-
-    # An "intraline" difference is always a '-' line, possibly followed by
-    # '?' line, and immediately followed by a '+' line; the next line after
-    # that '+' might be another '?' line as well, or not.
-    # In short it is a sequence of one of: "-+", "-?+", "-?+?", "-+?". We
-    # don't want to look forward up to four characters, so we look at it
-    # from the perspective of a "+".  Before a "+" we must have seen a "-"
-    # or a "-?".  That is what we encode in `open_intraline_block`.
-    diff = difflib.ndiff(diffLinesA, diffLinesB, charjunk=None)
-    found_intraline_changes: list[tuple[int, str, str]] = []
-    open_intraline_block = False
-    for prev_line, line, next_line in triplewise(chain([""], diff, [""])):
-        code = line[:1]
-        if code == " ":
-            bufferA.append(linesA.popleft())
-            bufferB.append(linesB.popleft())
-
-        elif code == "-":
-            bufferA.append(linesA.popleft())
-            highlightA.append(len(bufferA) - 1)
-            if next_line.startswith((" ", "-")):
-                bufferB.append("")
-
-        elif code == "+":
-            bufferB.append(linesB.popleft())
-            highlightB.append(len(bufferB) - 1)
-            if open_intraline_block:
-                if highlightB[-1] != highlightA[-1]:
-                    print(f"assertion failed: {highlightB[-1]} != {highlightA[-1]}")
-                found_intraline_changes.append((highlightB[-1], bufferA[-1], bufferB[-1]))
-            else:
-                bufferA.append("")
-
-        elif code == "?":
-            # There is a cheap intra line diff here, but since we filtered
-            # the view contents, we cannot use it.
-            ...
-
-        open_intraline_block = code == "-" or (code == "?" and prev_line.startswith("-"))
-
-    return "\n".join(bufferA), "\n".join(bufferB), highlightA, highlightB, found_intraline_changes
+    if sbs_settings().get('enable_intraline', True) and found_intraline_changes:
+        IntralineColorizer(
+            view1, view2, found_intraline_changes,
+            result.intraline_offsetsA, result.intraline_offsetsB, metrics
+        ).start()
+    else:
+        report_metrics(metrics, (view1, view2))
+
+    # The placeholders of collapsed rows are not part of the text.
+    if (
+        sbs_settings().get('live_diff', True)
+        and not view1.is_read_only()
+        and not view2.is_read_only()
+        and get_folds(view1) is None
+    ):
+        LiveDiff(view1, view2, result)
 
 
-def highlight_lines(view, lines, col):
-    # full line diffs
-    regionList = []
-    markers = []
-    for lineNum in lines:
-        lineStart = view.text_point(lineNum, 0)
-        markers.append(lineStart)
-        lineEnd = view.text_point(lineNum + 1, -1)
-        region = sublime.Region(lineStart, lineEnd)
-        regionList.append(region)
+def highlight_lines(view, spans, col):
+    # full line diffs, one region per block of changed lines
+    regionList = [sublime.Region(a, b) for a, b in spans]
 
     colour = "diff.deleted.sbs-compare"
     if col == 'B':
         colour = "diff.inserted.sbs-compare"
 
     drawType = get_drawtype()
-    view.add_regions('diff_highlighted-' + col, regionList, colour, '', drawType)
-    view.settings().set('sbs_markers', markers)
+    view.add_regions('diff_highlighted-' + col, merge_regions(regionList), colour, '', drawType)
 
 
-def colorize_intraline(
-    view1: sublime.View,
-    view2: sublime.View,
-    found_intraline_changes: list[tuple[int, str, str]]
-):
-    subHighlightA, subHighlightB = compute_intraline_differences(view1, view2, found_intraline_changes)
-    sub_highlight_lines(view1, subHighlightA, 'A')
-    sub_highlight_lines(view2, subHighlightB, 'B')
+def highlight_moved(view, spans, col):
+    # blocks of lines moved elsewhere, the same colour on both sides
+    regionList = [sublime.Region(a, b) for a, b in spans]
+    drawType = get_drawtype()
+    view.add_regions(
+        'diff_moved-' + col, merge_regions(regionList), 'diff.changed.sbs-compare', '', drawType
+    )
 
 
-def compute_intraline_differences(
-    view1: sublime.View,
-    view2: sublime.View,
-    found_intraline_changes: list[tuple[int, str, str]]
-) -> tuple[list[tuple[int, int, int]], list[tuple[int, int, int]]]:
-    intraline_emptyspace = sbs_settings().get('intraline_emptyspace', False)
-    subHighlightA: list[tuple[int, int, int]] = []
-    subHighlightB: list[tuple[int, int, int]] = []
-    for line_num, left, right in found_intraline_changes:
-        s = difflib.SequenceMatcher(None, left, right)
-        for tag, i1, i2, j1, j2 in s.get_opcodes():
-            if tag != 'equal':  # == replace
-                if intraline_emptyspace:
-                    if tag == 'insert':
-                        i2 += j2 - j1
-                    if tag == 'delete':
-                        j2 += i2 - i1
-
-                subHighlightA.append((line_num, i1, i2))
-                subHighlightB.append((line_num, j1, j2))
-
-    return subHighlightA, subHighlightB
-
-
-def sub_highlight_lines(view, lines, col):
-    regionList = [
-        sublime.Region(view.text_point(line, a), view.text_point(line, b))
-        for line, a, b in lines
-    ]
+# window id -> the intraline colorizer working on the comparison in that window
+intraline_colorizers: dict[int, IntralineColorizer] = {}
+
+
+class IntralineColorizer:
+    """Compute and draw the intraline changes, visible lines first.
+
+    The pending line pairs are worked off in batches.  Each batch is the
+    run of pending rows closest to the current viewport.  The first batch
+    is just what is visible; batch sizes then double to keep the number
+    of `add_regions` calls, which redraw *all* regions, logarithmic.
+    """
+    MIN_BATCH = 64
+    MAX_BATCH = 8192
+
+    def __init__(self, view1, view2, found_intraline_changes, offsetsA, offsetsB, metrics=None):
+        self.view1 = view1
+        self.view2 = view2
+        self.window_id = view1.window().id()
+        # row -> (left, right, offset of the row in view1, offset in view2)
+        self.changes = {
+            row: (left, right, offsetA, offsetB)
+            for (row, left, right), offsetA, offsetB
+            in zip(found_intraline_changes, offsetsA, offsetsB)
+        }
+        self.pending = sorted(self.changes)
+        self.regionsA = view1.get_regions('diff_intraline-A')
+        self.regionsB = view2.get_regions('diff_intraline-B')
+        self.batch_size = 0
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.metrics = metrics
+
+    def start(self):
+        intraline_colorizers[self.window_id] = self
+        threading.Thread(target=self.run).start()
+
+    def cancel(self):
+        # Our offsets are stale once the user edits the views.
+        self.cancelled = True
+        report_metrics(self.metrics, (self.view1, self.view2))
+
+    def shifted(self, rows: Shifts, offsetsA: Shifts, offsetsB: Shifts) -> IntralineColorizer:
+        """Return a colorizer for the rest of our work, after text got inserted."""
+        changes = sorted(self.changes.items())
+        # The metrics are the successor's to report.
+        metrics, self.metrics = self.metrics, None
+        return IntralineColorizer(
+            self.view1, self.view2,
+            [(rows(row), left, right) for row, (left, right, _, _) in changes],
+            [offsetsA(a) for _, (_, _, a, _) in changes],
+            [offsetsB(b) for _, (_, _, _, b) in changes],
+            metrics,
+        )
+
+    def reprioritize(self):
+        # Called when the user scrolls: start over with what is visible now.
+        with self.lock:
+            self.batch_size = 0
+
+    def run(self):
+        while self.view1.is_valid() and self.view2.is_valid() and not self.cancelled:
+            batch = self.next_batch()
+            if not batch:
+                break
+            # Rows leave `changes` only once they are drawn, see `shifted`.
+            changes = {row: self.changes[row] for row in batch}
+            with maybe_piece(self.metrics, 'intraline') as record:
+                subHighlightA, subHighlightB = run_compute_intraline_differences(
+                    [(row, left, right) for row, (left, right, _, _) in changes.items()]
+                )
+                record.update(
+                    lines=len(batch), sub_highlights=len(subHighlightA) + len(subHighlightB)
+                )
+            spansA = [(changes[row][2] + a, changes[row][2] + b) for row, a, b in subHighlightA]
+            spansB = [(changes[row][3] + a, changes[row][3] + b) for row, a, b in subHighlightB]
+            sublime.set_timeout(partial(self.draw, batch, spansA, spansB))
+
+    def next_batch(self) -> list[int]:
+        pending = self.pending
+        if not pending:
+            return []
+        visible = self.view1.visible_region()
+        top = self.view1.rowcol(visible.begin())[0]
+        bottom = self.view1.rowcol(visible.end())[0]
+        lo = bisect_left(pending, top)
+        hi = bisect_right(pending, bottom)
+        with self.lock:
+            if self.batch_size:
+                self.batch_size = min(self.batch_size * 2, self.MAX_BATCH)
+            else:
+                self.batch_size = max(hi - lo, self.MIN_BATCH)
+            size = self.batch_size
+
+        # Grow the window of rows in whichever direction is closer.
+        while hi - lo < size and (lo > 0 or hi < len(pending)):
+            if hi == len(pending) or (lo > 0 and top - pending[lo - 1] <= pending[hi] - bottom):
+                lo -= 1
+            else:
+                hi += 1
+        batch = pending[lo:hi]
+        self.pending = pending[:lo] + pending[hi:]
+        return batch
+
+    def draw(self, batch, spansA, spansB):
+        if self.cancelled:
+            return
+        for row in batch:
+            del self.changes[row]
+        # We are done once the last batch is drawn.
+        if not self.changes and intraline_colorizers.get(self.window_id) is self:
+            del intraline_colorizers[self.window_id]
+        with maybe_piece(self.metrics, 'intraline_draw') as record:
+            self.regionsA.extend(sublime.Region(a, b) for a, b in merge_spans(spansA))
+            self.regionsB.extend(sublime.Region(a, b) for a, b in merge_spans(spansB))
+            add_intraline_regions(self.view1, self.regionsA, 'A')
+            add_intraline_regions(self.view2, self.regionsB, 'B')
+            record['batches'] = 1
+        if not self.changes:
+            report_metrics(self.metrics, (self.view1, self.view2))
+
+
+def add_intraline_regions(view, regionList, col):
     color = "diff.inserted.char.sbs-compare" if col == 'B' else "diff.deleted.char.sbs-compare"
     drawType = get_drawtype()
     view.add_regions('diff_intraline-' + col, regionList, color, '', drawType)
 
 
+# window id -> the live diff of the (editable) comparison in that window
+live_diffs: dict[int, LiveDiff] = {}
+
+
+class LiveDiff:
+    """Re-diff the edited rows of a comparison while the user types.
+
+    Only the dirty rows, grown to the nearest rows equal on both sides,
+    are diffed again.  Then the padding and the highlights of just these
+    rows are patched in place.
+    """
+    def __init__(self, view1, view2, result: DiffResult):
+        self.views = (view1, view2)
+        self.window_id = view1.window().id()
+        self.alignment = Alignment(
+            result.bufferA.count('\n') + 1, result.highlightA, result.highlightB
+        )
+        # per side, the number of our own padding patches still to be
+        # reported by the listener, which we ignore
+        self.skip = [0, 0]
+        # per side, the flags of the rows of deletions which took padding
+        # with them, (row, col, flags), to restore them on undo
+        self.deletions: tuple[deque, deque] = (deque(maxlen=100), deque(maxlen=100))
+        # per side, whether the next change is the undo of an edit
+        self.undone = [False, False]
+        self.scheduled = False
+        # set while we run undo ourselves
+        self.undoing = False
+        self.listeners = [LiveDiffListener(self, side) for side in (0, 1)]
+        for listener, view in zip(self.listeners, self.views):
+            listener.attach(view.buffer())
+        live_diffs[self.window_id] = self
+
+    def stop(self):
+        for listener in self.listeners:
+            if listener.is_attached():
+                listener.detach()
+        if live_diffs.get(self.window_id) is self:
+            del live_diffs[self.window_id]
+
+    def on_text_changed(self, side, changes):
+        if self.skip[side]:
+            self.skip[side] -= 1
+            return
+        undone, self.undone[side] = self.undone[side], False
+
+        flags = self.alignment.flags[side]
+        deletions = self.deletions[side]
+        try:
+            for change in changes:
+                a, b, text = change.a, change.b, change.str
+                if a.pt == b.pt and not text:
+                    continue
+                last_line = text.rpartition('\n')[2]
+                rows = text.count('\n') + 1
+                if a.row < b.row and PADDING in flags[a.row:b.row + 1]:
+                    deletions.append((a.row, a.col, flags[a.row:b.row + 1]))
+                # Whether the last of the new rows is the untouched old one.
+                keep_last = b.col == 0 and not last_line and (rows > 1 or a.col == 0)
+                self.alignment.edit(side, a.row, b.row, rows, keep_last)
+                if (
+                    undone and a.pt == b.pt and deletions
+                    and deletions[-1][:2] == (a.row, a.col) and len(deletions[-1][2]) == rows
+                ):
+                    # Bring back the padding the undone deletion took.
+                    flags[a.row:a.row + rows] = deletions.pop()[2]
+        except IndexError:
+            self.fail()
+            return
+
+        if colorizer := intraline_colorizers.pop(self.window_id, None):
+            colorizer.cancel()
+        if not self.scheduled:
+            self.scheduled = True
+            sublime.set_timeout(self.rediff)
+
+    def fail(self):
+        self.stop()
+        for view in self.views:
+            if view.is_valid():
+                view.set_status('sbs_compare', 'live diff stopped, compare again to refresh')
+
+    def rediff(self):
+        self.scheduled = False
+        view1, view2 = self.views
+        if not (view1.is_valid() and view2.is_valid()):
+            self.stop()
+            return
+        alignment = self.alignment
+        if not alignment.dirty:
+            return
+
+        top, endA, endB = alignment.window()
+        oldA = alignment.flags[0][top:endA]
+        oldB = alignment.flags[1][top:endB]
+        linesA = view_lines(view1, top, endA)
+        linesB = view_lines(view2, top, endB)
+        if len(linesA) != len(oldA) or len(linesB) != len(oldB):
+            self.fail()
+            return
+
+        linesA = [line for line, flag in zip(linesA, oldA) if flag != PADDING]
+        linesB = [line for line, flag in zip(linesB, oldB) if flag != PADDING]
+        result = compute_diff(
+            ''.join(line + '\n' for line in linesA),
+            ''.join(line + '\n' for line in linesB),
+            diff_options()
+        )
+        rows = len(linesA) + len(set(result.highlightB).difference(result.highlightA))
+        newA = rows_flags(rows, result.highlightA, result.highlightB)
+        newB = rows_flags(rows, result.highlightB, result.highlightA)
+
+        self.patch_padding(0, top, oldA, newA)
+        self.patch_padding(1, top, oldB, newB)
+        alignment.replace(top, endA, endB, newA, newB)
+
+        self.patch_highlights(top, result)
+        if window := view1.window():
+            hunks = hunk_indexes[window.id()] = HunkIndex.from_rows(
+                alignment.changed_rows(0), alignment.changed_rows(1)
+            )
+            show_hunk_status(self.views, hunks, None)
+
+    def patch_padding(self, side, top, old, new):
+        edits = padding_edits(old, new)
+        if not edits:
+            return
+        view = self.views[side]
+        self.skip[side] += 1
+        view.run_command('sbs_patch_padding', {
+            'edits': [(top + row, remove, insert) for row, remove, insert in edits]
+        })
+
+    def patch_highlights(self, top, result: DiffResult):
+        options = diff_options()
+        intraline = (
+            sbs_settings().get('enable_intraline', True) and result.found_intraline_changes
+        )
+        if intraline:
+            subHighlightA, subHighlightB = compute_intraline_differences(
+                result.found_intraline_changes, options
+            )
+            rows = [row for row, _, _ in result.found_intraline_changes]
+
+        for view, col, buffer, regions, moved, side in (
+            (self.views[0], 'A', result.bufferA, result.regionsA, result.movedA, 0),
+            (self.views[1], 'B', result.bufferB, result.regionsB, result.movedB, 1),
+        ):
+            start = view.text_point(top, 0)
+            end = start + len(buffer)
+
+            def outside(key):
+                return [
+                    region for region in view.get_regions(key)
+                    if region.end() < start or region.begin() > end
+                ]
+
+            highlight_lines(
+                view,
+                [(r.a, r.b) for r in outside('diff_highlighted-' + col)]
+                + [(start + a, start + b) for a, b in regions],
+                col
+            )
+            highlight_moved(
+                view,
+                [(r.a, r.b) for r in outside('diff_moved-' + col)]
+                + [(start + a, start + b) for a, b in moved],
+                col
+            )
+            intralineRegions = outside('diff_intraline-' + col)
+            if intraline:
+                offsets = dict(zip(rows, (
+                    result.intraline_offsetsA if side == 0 else result.intraline_offsetsB
+                )))
+                intralineRegions += merge_regions(
+                    sublime.Region(start + offsets[row] + a, start + offsets[row] + b)
+                    for row, a, b in (subHighlightA if side == 0 else subHighlightB)
+                )
+            add_intraline_regions(view, intralineRegions, col)
+
+    def revert_patch(self, side, edits):
+        """Take back the padding `edits` of `side`, which are about to be undone.
+
+        We know exactly which rows come back as padding, and ignore the
+        text change of the undo itself.
+        """
+        for row, remove, insert in reversed(edits):
+            self.alignment.edit(side, row, row + insert - 1, remove, padding=True)
+        self.skip[side] += 1
+
+    def undo_edit(self, side):
+        """Undo the last edit in `side`, along with our patches on top of it."""
+        view = self.views[side]
+        while (last := view.command_history(0, True))[0] == 'sbs_patch_padding':
+            self.revert_patch(side, last[1]['edits'])
+            self.run_undo(side)
+        self.undone[side] = True
+        self.run_undo(side)
+
+    def run_undo(self, side):
+        self.undoing = True
+        try:
+            self.views[side].run_command('undo')
+        finally:
+            self.undoing = False
+
+
+class LiveDiffListener(sublime_plugin.TextChangeListener):
+    def __init__(self, live: LiveDiff, side: int):
+        super().__init__()
+        self.live = live
+        self.side = side
+
+    @classmethod
+    def is_applicable(cls, buffer):
+        # We attach ourselves, see `LiveDiff`.
+        return False
+
+    def on_text_changed(self, changes):
+        self.live.on_text_changed(self.side, changes)
+
+
+class SbsLiveDiffListener(sublime_plugin.EventListener):
+    def on_text_command(self, view, command_name, args):
+        if command_name not in ('undo', 'soft_undo'):
+            return None
+        window = view.window()
+        live = window and live_diffs.get(window.id())
+        if not live or live.undoing:
+            return None
+        side = 0 if live.views[0].id() == view.id() else 1
+        name, patch, _ = view.command_history(0, True)
+        if name == 'sbs_patch_padding':
+            # Users want to undo their edit, not just our patch.
+            live.revert_patch(side, patch['edits'])
+            sublime.set_timeout(partial(live.undo_edit, side))
+        else:
+            live.undone[side] = True
+        return None
+
+
+def view_lines(view, first_row, end_row):
+    """Return the lines `first_row` to `end_row` (exclusive) of `view`."""
+    begin = view.text_point(first_row, 0)
+    end = view.line(view.text_point(end_row - 1, 0)).end()
+    return view.substr(sublime.Region(begin, end)).split('\n')
+
+
+class sbs_patch_padding(sublime_plugin.TextCommand):
+    def run(self, edit, edits):
+        view = self.view
+        last_row = view.rowcol(view.size())[0]
+        for row, remove, insert in edits:
+            point = view.text_point(row, 0)
+            if remove:
+                if row + remove <= last_row:
+                    view.erase(edit, sublime.Region(point, view.text_point(row + remove, 0)))
+                else:
+                    # The padding ends the buffer, drop the newlines before its rows.
+                    view.erase(edit, sublime.Region(max(point - 1, 0), view.size()))
+            if insert:
+                view.insert(edit, point, '\n' * insert)
+
+
+# window id -> the scroll syncer of the comparison in that window
+scroll_syncers: dict[int, ViewScrollSyncer] = {}
+
+
 class ViewScrollSyncer(object):
+    """Keep the viewports of both views of a comparison in sync.
+
+    There is no scroll event in Sublime, so we still poll, but back off
+    while nothing moves.  Selection changes, commands and activation of
+    a comparison view `wake()` us up to poll fast again.
+    """
     def __init__(self, window, viewList):
         self.window = window
         self.views = viewList
         self.timeout_focused = 10
-        self.timeout_unfocused = 50
+        self.timeout_idle = 250
+        self.timeout_unfocused = 1000
+        self.timeout = self.timeout_focused
+        self.last_vec = viewList[0].viewport_position()
+        # Bumped for every scheduled poll; outdated polls are dropped.
+        self.generation = 0
 
-        self.run()
+        scroll_syncers[window.id()] = self
+        self.schedule()
+
+    def schedule(self):
+        self.generation += 1
+        sublime.set_timeout(partial(self.run, self.generation), self.timeout)
+
+    def wake(self):
+        self.timeout = self.timeout_focused
+        self.sync()
+        self.schedule()
 
     def update_scroll(self, view1, view2, lastUpdated):
         if lastUpdated == 'A':
@@ -568,85 +1754,118 @@ class ViewScrollSyncer(object):
         elif lastUpdated == 'B':
             view1.set_viewport_position(view2.viewport_position(), False)
 
-    def run(self):
+        if colorizer := intraline_colorizers.get(self.window.id()):
+            colorizer.reprioritize()
+
+    def run(self, generation):
+        if generation != self.generation:
+            return
+
         if not self.window.is_valid():
+            if scroll_syncers.get(self.window.id()) is self:
+                del scroll_syncers[self.window.id()]
             return
 
-        if self.window.id() != sublime.active_window().id():
-            sublime.set_timeout(self.run, self.timeout_unfocused)
+        if not self.views[0].is_valid() or not self.views[1].is_valid():
             return
 
+        if self.window.id() != sublime.active_window().id():
+            self.timeout = self.timeout_unfocused
+        elif self.sync():
+            self.timeout = self.timeout_focused
+        else:
+            self.timeout = min(self.timeout * 2, self.timeout_idle)
+        self.schedule()
+
+    def sync(self) -> bool:
+        """Sync the viewports, return whether one of them moved."""
         view1 = self.views[0]
         view2 = self.views[1]
 
-        if not view1.is_valid() or not view2.is_valid():
-            return
-
         vecA = view1.viewport_position()
         vecB = view2.viewport_position()
+        if vecA == vecB:
+            self.last_vec = vecA
+            return False
+
+        lastVec = self.last_vec
+        lastUpdated = ''
+        if lastVec != vecA:
+            lastUpdated = 'A'
+            self.last_vec = vecA
+
+        if lastVec != vecB:
+            lastUpdated = 'B'
+            self.last_vec = vecB
 
-        if vecA != vecB:
-            lastVecA0 = view1.settings().get('viewsync_last_vec0', 1)
-            lastVecA1 = view1.settings().get('viewsync_last_vec1', 1)
+        if lastUpdated != '':
+            self.update_scroll(view1, view2, lastUpdated)
+            return True
+        return False
 
-            lastVecB0 = view2.settings().get('viewsync_last_vec0', 1)
-            lastVecB1 = view2.settings().get('viewsync_last_vec1', 1)
 
-            lastVecA = (lastVecA0, lastVecA1)
-            lastVecB = (lastVecB0, lastVecB1)
+class SbsScrollSyncListener(sublime_plugin.EventListener):
+    def wake_syncer(self, view):
+        if not view.settings().get('is_sbs_compare'):
+            return
+        window = view.window()
+        if window and (syncer := scroll_syncers.get(window.id())):
+            syncer.wake()
+
+    def on_activated(self, view):
+        self.wake_syncer(view)
 
-            lastUpdated = ''
+    def on_selection_modified(self, view):
+        self.wake_syncer(view)
 
-            if lastVecA != vecA:
-                lastUpdated = 'A'
+    def on_post_text_command(self, view, command_name, args):
+        self.wake_syncer(view)
 
-                view1.settings().set('viewsync_last_vec0', vecA[0])
-                view1.settings().set('viewsync_last_vec1', vecA[1])
+    def on_hover(self, view, point, hover_zone):
+        self.wake_syncer(view)
 
-                view2.settings().set('viewsync_last_vec0', vecA[0])
-                view2.settings().set('viewsync_last_vec1', vecA[1])
 
-            if lastVecB != vecB:
-                lastUpdated = 'B'
+# window id -> the hunks of the comparison in that window
+hunk_indexes: dict[int, HunkIndex] = {}
 
-                view1.settings().set('viewsync_last_vec0', vecB[0])
-                view1.settings().set('viewsync_last_vec1', vecB[1])
 
-                view2.settings().set('viewsync_last_vec0', vecB[0])
-                view2.settings().set('viewsync_last_vec1', vecB[1])
+def get_hunks(view) -> HunkIndex | None:
+    if not view.settings().get('is_sbs_compare'):
+        return None
+    window = view.window()
+    return hunk_indexes.get(window.id()) if window else None
 
-            if lastUpdated != '':
-                self.update_scroll(view1, view2, lastUpdated)
 
-        sublime.set_timeout(self.run, self.timeout_focused)
+def show_hunk_status(views, hunks, n):
+    if n is None:
+        message = f"{len(hunks)} hunks"
+    else:
+        message = f"hunk {n + 1} of {len(hunks)}"
+    for view in views:
+        view.set_status('sbs_hunks', message)
 
 
 def sbs_scroll_to(view, prev=False):
-    if not view.settings().get('is_sbs_compare'):
+    hunks = get_hunks(view)
+    if hunks is None:
         return
 
-    current_pos = view.sel()[0].begin()
-    regions = view.settings().get('sbs_markers')
-    if prev:
-        regions.reverse()
+    current_row = view.rowcol(view.sel()[0].begin())[0]
+    n = hunks.prev(current_row) if prev else hunks.next(current_row)
+    if n is None:
+        msg = 'Reached the ' + ('beginning' if prev else 'end')
+        view.window().show_quick_panel([msg], None)
+        return
 
-    for highlight in regions:
-        found = False
-        if prev:
-            if highlight < current_pos:
-                found = True
-        else:
-            if highlight > current_pos:
-                found = True
+    goto_hunk(view, hunks, n)
 
-        if found:
-            view.sel().clear()
-            view.sel().add(sublime.Region(highlight))
-            view.show(highlight)
-            return
 
-    msg = 'Reached the ' + 'beginning' if prev else 'end'
-    view.window().show_quick_panel([msg], None)
+def goto_hunk(view, hunks, n):
+    point = view.text_point(hunks.starts[n], 0)
+    view.sel().clear()
+    view.sel().add(sublime.Region(point))
+    view.show(point)
+    show_hunk_status(view.window().views(), hunks, n)
 
 
 class sbs_prev_diff(sublime_plugin.TextCommand):
@@ -665,6 +1884,132 @@ class sbs_next_diff(sublime_plugin.TextCommand):
         sbs_scroll_to(self.view)
 
 
+class sbs_goto_hunk(sublime_plugin.TextCommand):
+    def is_visible(self):
+        return self.view.settings().get("is_sbs_compare", False)
+
+    def is_enabled(self, hunk=None):
+        return bool(get_hunks(self.view))
+
+    def run(self, edit, hunk=None):
+        hunks = get_hunks(self.view)
+        if not hunks:
+            return
+
+        if hunk is None:
+            self.view.window().show_input_panel(
+                f"Go to hunk (1-{len(hunks)}):",
+                '',
+                lambda text: self.view.run_command('sbs_goto_hunk', {'hunk': text}),
+                None,
+                None,
+            )
+            return
+
+        try:
+            n = int(hunk) - 1
+        except ValueError:
+            return
+        goto_hunk(self.view, hunks, max(0, min(n, len(hunks) - 1)))
+
+
+# window id -> the views of the comparison in that window and its folds
+folded_comparisons: dict[int, tuple[tuple[sublime.View, sublime.View], Folds]] = {}
+
+
+def get_folds(view) -> Folds | None:
+    window = view.window()
+    entry = window and folded_comparisons.get(window.id())
+    return entry[1] if entry else None
+
+
+def show_folds(view1, view2, folds: Folds):
+    folded_comparisons[view1.window().id()] = ((view1, view2), folds)
+    for view in (view1, view2):
+        add_fold_regions(view, [view.line(view.text_point(row, 0)) for row in folds.rows])
+
+
+def add_fold_regions(view, regionList):
+    view.add_regions(
+        'sbs_folds', regionList, 'comment.sbs-compare', '',
+        sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_STIPPLED_UNDERLINE
+    )
+
+
+def folds_at_cursors(view) -> list[int]:
+    """Return the numbers of the folds with a cursor on their placeholder."""
+    rows = {view.rowcol(region.b)[0] for region in view.sel()}
+    return [
+        n for n, region in enumerate(view.get_regions('sbs_folds'))
+        if view.rowcol(region.a)[0] in rows
+    ]
+
+
+def expand_folds(views, folds: Folds, numbers):
+    """Bring back the collapsed rows of the given folds in both views."""
+    # Bottom-up, so the positions of the remaining folds stay put.
+    expansions = []
+    for n in sorted(numbers, reverse=True):
+        texts = folds.expand(n)
+        inserted = []
+        for view, text in zip(views, texts):
+            region = view.get_regions('sbs_folds')[n]
+            view.run_command('sbs_replace_view_contents', {
+                'token': stash_payload(text), 'region': (region.a, region.b)
+            })
+            # The other placeholders moved along with the edit.
+            regions = view.get_regions('sbs_folds')
+            del regions[n]
+            add_fold_regions(view, regions)
+            inserted.append((region.a, len(text) - region.size()))
+        row = views[0].rowcol(inserted[0][0])[0]
+        expansions.append((row, texts[0].count('\n'), inserted))
+    if not expansions:
+        return
+
+    # Everything after an expanded placeholder moved down.
+    rows, offsetsA, offsetsB = Shifts(), Shifts(), Shifts()
+    for row, added_rows, ((pointA, charsA), (pointB, charsB)) in reversed(expansions):
+        rows.add(row + 1, added_rows)
+        offsetsA.add(pointA + 1, charsA)
+        offsetsB.add(pointB + 1, charsB)
+    window_id = views[0].window().id()
+    if hunks := hunk_indexes.get(window_id):
+        hunks.remap(rows)
+    if colorizer := intraline_colorizers.pop(window_id, None):
+        successor = colorizer.shifted(rows, offsetsA, offsetsB) if colorizer.changes else None
+        colorizer.cancel()
+        if successor:
+            successor.start()
+
+
+class sbs_expand_context(sublime_plugin.TextCommand):
+    """Expand the collapsed rows under the cursors, or `all` of them."""
+    def is_visible(self, all=False):
+        return get_folds(self.view) is not None
+
+    def is_enabled(self, all=False):
+        return bool(get_folds(self.view)) and (all or bool(folds_at_cursors(self.view)))
+
+    def run(self, edit, all=False):
+        window = self.view.window()
+        entry = window and folded_comparisons.get(window.id())
+        if not entry:
+            return
+        views, folds = entry
+        expand_folds(views, folds, range(len(folds)) if all else folds_at_cursors(self.view))
+
+
+class SbsFoldsListener(sublime_plugin.EventListener):
+    def on_query_context(self, view, key, operator, operand, match_all):
+        if key != 'sbs_on_collapsed_rows':
+            return None
+        on_fold = get_folds(view) is not None and bool(folds_at_cursors(view))
+        if operator == sublime.OP_NOT_EQUAL:
+            return on_fold != operand
+        return on_fold == operand
+
+
 class sbs_select_text(sublime_plugin.TextCommand):
     def run(self, edit, index=''):
         window = self.view.window()
@@ -673,7 +2018,7 @@ class sbs_select_text(sublime_plugin.TextCommand):
             menu_items = ['Select removed text', 'Select added text']
             window.show_quick_panel(
                 menu_items,
-                lambda i: window.run_command('sbs_select_text', {'index': i}),
+                lambda i: i >= 0 and window.run_command('sbs_select_text', {'index': i}),
             )
             return
 
@@ -682,23 +2027,9 @@ class sbs_select_text(sublime_plugin.TextCommand):
         regions = (
             view.get_regions('diff_highlighted-A')
             + view.get_regions('diff_highlighted-B')
+            + view.get_regions('diff_moved-A')
+            + view.get_regions('diff_moved-B')
             + view.get_regions('diff_intraline-A')
             + view.get_regions('diff_intraline-B')
         )
-
-        combined_regions = []
-        # hacky but necessary to combine regions both start==end AND end==start
-        # there's probably a better way to do this
-        for it in range(0, 2):
-            for r in regions:
-                skip = False
-                for cr in combined_regions:
-                    if r.a == cr.b or r.b == cr.a:
-                        cr.b = max(r.b, cr.b)
-                        skip = True
-                        break
-                if not skip:
-                    combined_regions.append(r)
-
-        for r in combined_regions:
-            view.sel().add(r)
+        view.sel().add_all(merge_regions(regions))
@@ -111,6 +111,7 @@ def set_timeout_async(f: Callable[[], None], timeout_ms: int = ...) -> None: ...
 def active_window() -> Window: ...
 def windows() -> Sequence[Window]: ...
 def get_macro() -> Sequence[dict]: ...
+def find_syntax_for_file(path: str, first_line: str = ...) -> Optional[Syntax]: ...
 
 WindowId = NewType('WindowId', int)
 BufferId = NewType('BufferId', int)
@@ -253,6 +254,28 @@ class Sheet:
     def window(self) -> Optional[Window]: ...
     def view(self) -> Optional[View]: ...
 
+class HistoricPosition:
+    pt = ...  # type: Point
+    row = ...  # type: int
+    col = ...  # type: int
+    col_utf16 = ...  # type: int
+    col_utf8 = ...  # type: int
+
+class TextChange:
+    a = ...  # type: HistoricPosition
+    b = ...  # type: HistoricPosition
+    len_utf16 = ...  # type: int
+    len_utf8 = ...  # type: int
+    str = ...  # type: str
+
+class Buffer:
+    buffer_id = ...  # type: BufferId
+    def __init__(self, id: int) -> None: ...
+    def id(self) -> BufferId: ...
+    def file_name(self) -> Optional[str]: ...
+    def views(self) -> List[View]: ...
+    def primary_view(self) -> View: ...
+
 class View:
     view_id = ...  # type: ViewId
     selection = ...  # type: Any
@@ -263,6 +286,7 @@ class View:
     def __bool__(self) -> bool: ...
     def id(self) -> ViewId: ...
     def buffer_id(self) -> BufferId: ...
+    def buffer(self) -> Buffer: ...
     def is_valid(self) -> bool: ...
     def is_primary(self) -> bool: ...
     def window(self) -> Optional[Window]: ...
@@ -410,6 +434,12 @@ class View:
     def set_reference_document(self, reference: str) -> None: ...
     def reset_reference_document(self) -> None: ...
 
+class Syntax:
+    path = ...  # type: str
+    name = ...  # type: str
+    hidden = ...  # type: bool
+    scope = ...  # type: str
+
 class Settings:
     settings_id = ...  # type: Any
     def __init__(self, id) -> None: ...
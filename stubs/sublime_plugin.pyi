@@ -3,7 +3,7 @@
 # NOTE: This dynamically typed stub was automatically generated by stubgen.
 
 import sublime
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 WindowCommandR = Optional[Tuple[str, Optional[Dict[str, Any]]]]
 
@@ -114,6 +114,16 @@ class ViewEventListener:
     def applies_to_primary_view_only(cls) -> bool: ...
     def __init__(self, view: sublime.View) -> None: ...
 
+class TextChangeListener:
+    buffer = ...  # type: Optional[sublime.Buffer]
+    @classmethod
+    def is_applicable(cls, buffer: sublime.Buffer) -> bool: ...
+    def __init__(self) -> None: ...
+    def attach(self, buffer: sublime.Buffer) -> None: ...
+    def detach(self) -> None: ...
+    def is_attached(self) -> bool: ...
+    def on_text_changed(self, changes: List[sublime.TextChange]) -> None: ...
+
 class MultizipImporter:
     loaders = ...  # type: Any
     file_loaders = ...  # type: Any
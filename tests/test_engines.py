@@ -0,0 +1,126 @@
+"""Line diff engines and their budgets, see `core.engines`."""
+from __future__ import annotations
+import random
+import unittest
+
+from core.budget import Budget, BudgetExceeded
+from core.diff import compute_diff
+from core.engines import ENGINES, get_opcodes, ndiff_opcodes
+
+
+def lcs_length(a, b):
+    """Return the length of the longest common subsequence, the slow way."""
+    row = [0] * (len(b) + 1)
+    for x in a:
+        previous = 0
+        for j, y in enumerate(b):
+            previous, row[j + 1] = row[j + 1], (
+                previous + 1 if x == y else max(row[j], row[j + 1])
+            )
+    return row[-1]
+
+
+def random_pairs(count, alphabet='abcde', max_length=12):
+    rng = random.Random(4)
+    for _ in range(count):
+        yield (
+            [rng.choice(alphabet) for _ in range(rng.randrange(max_length))],
+            [rng.choice(alphabet) for _ in range(rng.randrange(max_length))],
+        )
+
+
+EDGE_CASES = [
+    ([], []),
+    ([], list('abc')),
+    (list('abc'), []),
+    (list('abc'), list('abc')),
+    (list('abc'), list('xyz')),
+    (list('aaaa'), list('aa')),
+    (list('abcabba'), list('cbabac')),
+]
+
+
+class TestEngines(unittest.TestCase):
+    def assertValid(self, a, b, opcodes):
+        """Assert that `opcodes` cover `a` and `b` in order and turn `a` into `b`."""
+        i = j = 0
+        rebuilt = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            self.assertEqual((i1, j1), (i, j))
+            self.assertTrue(i1 <= i2 and j1 <= j2)
+            if tag == 'equal':
+                self.assertEqual(a[i1:i2], b[j1:j2])
+                self.assertEqual(i2 - i1, j2 - j1)
+            else:
+                self.assertEqual(tag, {
+                    (True, True): 'replace', (True, False): 'delete', (False, True): 'insert'
+                }[(i1 < i2, j1 < j2)])
+            rebuilt += a[i1:i2] if tag == 'equal' else b[j1:j2]
+            i, j = i2, j2
+        self.assertEqual((i, j), (len(a), len(b)))
+        self.assertEqual(rebuilt, b)
+
+    def test_opcodes_turn_a_into_b(self):
+        for name, engine in ENGINES.items():
+            for a, b in EDGE_CASES + list(random_pairs(200)):
+                with self.subTest(engine=name, a=''.join(a), b=''.join(b)):
+                    self.assertValid(a, b, list(engine(a, b)))
+                    self.assertValid(a, b, list(get_opcodes(a, b, name)))
+
+    def test_myers_is_minimal(self):
+        for a, b in EDGE_CASES + list(random_pairs(300)):
+            with self.subTest(a=''.join(a), b=''.join(b)):
+                opcodes = list(ENGINES['myers'](a, b))
+                matched = sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == 'equal')
+                self.assertEqual(matched, lcs_length(a, b))
+
+    def test_edge_cases(self):
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                self.assertEqual(list(engine([], [])), [])
+                self.assertEqual(list(engine(list('abc'), list('abc'))), [('equal', 0, 3, 0, 3)])
+                # ndiff pairs only lines which are alike.
+                self.assertEqual(list(engine(list('abc'), list('xy'))), [
+                    ('insert', 0, 0, 0, 2), ('delete', 0, 3, 2, 2)
+                ] if name == 'ndiff' else [('replace', 0, 3, 0, 2)])
+                self.assertEqual(list(engine([], list('xy'))), [('insert', 0, 0, 0, 2)])
+                self.assertEqual(list(engine(list('abc'), [])), [('delete', 0, 3, 0, 0)])
+
+    def test_myers_runs_over_its_budget(self):
+        a, b = list('abcdefgh'), list('hgfedcba')
+        with self.assertRaises(BudgetExceeded):
+            list(get_opcodes(a, b, 'myers', Budget(3, None)))
+        self.assertValid(a, b, list(get_opcodes(a, b, 'myers', Budget(16, None))))
+
+
+class TestNdiff(unittest.TestCase):
+    def test_pairs_similar_lines_of_changed_blocks(self):
+        a = ['x', 'foo bar baz', 'y', 'z']
+        b = ['x', 'unrelated', 'foo bar bax', 'y', 'z']
+        self.assertEqual(list(ndiff_opcodes(a, b)), [
+            ('equal', 0, 1, 0, 1),
+            ('insert', 1, 1, 1, 2),
+            ('replace', 1, 2, 2, 3),
+            ('equal', 2, 4, 3, 5),
+        ])
+
+    def test_caps_pairs_before_pairing(self):
+        a, b = ['a', 'b', 'c', 'x'], ['A', 'B', 'C', 'x']
+        with self.assertRaises(BudgetExceeded):
+            next(ndiff_opcodes(a, b, Budget(None, None, 8)))
+        ops = list(ndiff_opcodes(a, b, Budget(None, None, 9)))
+        self.assertEqual(ops[-1], ('equal', 3, 4, 3, 4))
+
+    def test_steps_down_to_a_plain_line_diff(self):
+        a = ''.join(f'line {i}\n' for i in range(20))
+        b = ''.join(f'line {i}!\n' for i in range(20))
+        result = compute_diff(a, b, {'diff_algorithm': 'ndiff', 'diff_max_fuzzy_pairs': 100})
+        self.assertEqual(result.degraded, (
+            'plain line diff instead of ndiff '
+            '(changed blocks with more than 100 pairs of lines)',
+        ))
+        self.assertEqual(len(result.found_intraline_changes), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
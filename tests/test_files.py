@@ -0,0 +1,60 @@
+"""Reading files straight from disk, see `core.files`."""
+from __future__ import annotations
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.files import python_encoding, read_text
+from core.precheck import BINARY, SAME_TEXT, file_verdict
+
+
+TEXT = 'héllo\r\nwörld €\n'
+
+
+class TestReadText(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, data: bytes, name: str = 'file') -> str:
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_byte_order_marks(self):
+        for encoding in ('utf-8-sig', 'utf-16', 'utf-16-le', 'utf-16-be', 'utf-32', 'utf-32-le'):
+            with self.subTest(encoding):
+                data = TEXT.encode(encoding)
+                if not encoding.endswith(('sig', '16', '32')):
+                    data = '\ufeff'.encode(encoding) + data
+                self.assertEqual(read_text(self.write(data)), 'héllo\nwörld €\n')
+
+    def test_fallback_encoding(self):
+        path = self.write('привет\n'.encode('koi8-r'))
+        self.assertEqual(read_text(path, fallback='koi8-r'), 'привет\n')
+        # not valid in Windows 1252 either
+        self.assertEqual(read_text(self.write(b'a\x81b'), fallback='cp1252'), 'a\x81b')
+
+    def test_verdicts(self):
+        utf8 = self.write(TEXT.encode('utf-8'), 'utf8')
+        self.assertEqual(file_verdict(utf8, self.write(TEXT.encode('utf-16'))), SAME_TEXT)
+        koi8 = self.write('привет\n'.encode('koi8-r'), 'koi8')
+        self.assertIsNone(file_verdict(koi8, self.write('привет\n'.encode('utf-8'))))
+        self.assertEqual(
+            file_verdict(koi8, self.write('привет\n'.encode('utf-8')), 'koi8-r'), SAME_TEXT
+        )
+        self.assertEqual(file_verdict(utf8, self.write(b'a\0b')), BINARY)
+
+    def test_sublime_encoding_names(self):
+        self.assertEqual(python_encoding('Western (Windows 1252)'), 'cp1252')
+        self.assertEqual(python_encoding('Cyrillic (KOI8-R)'), 'koi8-r')
+        self.assertEqual(python_encoding('Western (DOS 437)'), 'cp437')
+        self.assertIsNone(python_encoding('Unknown (Nope)'))
+
+
+if __name__ == '__main__':
+    unittest.main()
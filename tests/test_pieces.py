@@ -0,0 +1,88 @@
+"""Cutting diffs into pieces for the views, see `core.pieces`."""
+from __future__ import annotations
+import sys
+import unittest
+
+from core.diff import compute_diff
+from core.pieces import PieceStream
+from core.pool import WorkerPool
+from core.regions import merge_spans
+
+
+A = ''.join(f'line {i}\n' for i in range(2000))
+B = A.replace('line 12', 'line twelve').replace('line 77\n', '') + 'the end'
+
+
+def joined(pieces):
+    """Return the texts and the regions of `pieces`, as if drawn one after another."""
+    return (
+        ''.join(piece.textA for piece in pieces),
+        ''.join(piece.textB for piece in pieces),
+        [merge_spans([span for piece in pieces for span in piece[k]]) for k in range(2, 6)],
+    )
+
+
+def covered(text, spans):
+    """Return the characters of `text` within `spans`, but the newlines pieces cut at."""
+    return {k for a, b in spans for k in range(a, b) if text[k] != '\n'}
+
+
+class TestPieceStream(unittest.TestCase):
+    def stream(self, a, b, options=None):
+        pieces = []
+        stream = PieceStream(pieces.append, 40, 1000, 4000)
+        return compute_diff(a, b, options or {}, stream=stream), pieces
+
+    def test_pieces_add_up_to_the_result(self):
+        for a, b in ((A, B), ('', ''), ('', B), (A, '')):
+            with self.subTest(a=len(a), b=len(b)):
+                result, pieces = self.stream(a, b, {'moved_min_lines': 0})
+                self.assertNotIn(None, pieces)
+                textA, textB, (regionsA, regionsB, movedA, movedB) = joined(pieces)
+                self.assertEqual((textA, textB), (result.bufferA, result.bufferB))
+                self.assertEqual(covered(textA, regionsA), covered(textA, result.regionsA))
+                self.assertEqual(covered(textB, regionsB), covered(textB, result.regionsB))
+                self.assertEqual((movedA, movedB), ([], []))
+
+    def test_first_piece_is_a_screenful(self):
+        result, pieces = self.stream(A, B)
+        self.assertEqual(pieces[0].textA.count('\n'), 40)
+        self.assertEqual(pieces[0].textB.count('\n'), 40)
+        self.assertTrue(all(len(piece.textA) < 4000 + 20 for piece in pieces))
+
+    def test_moves_are_not_streamed(self):
+        moved, rest = 'a\nb\nc\nd\n', ''.join(f'{i}\n' for i in range(10))
+        result, pieces = self.stream(moved + rest, rest + moved)
+        self.assertTrue(result.movedA)
+        regionsA, _, movedA, movedB = joined(pieces)[2]
+        self.assertEqual((movedA, movedB), ([], []))
+        # They are highlighted as changed until the diff is done.
+        for a, b in result.movedA:
+            self.assertTrue(any(start <= a and b <= end for start, end in regionsA))
+
+    def test_starting_over(self):
+        pieces = []
+        stream = PieceStream(pieces.append, 40, 1000, 4000)
+        compute_diff(A, A + 'x', {}, stream=stream)
+        stream.start()
+        result = compute_diff(A, B, {}, stream=stream)
+        restart = pieces.index(None)
+        self.assertEqual(joined(pieces[restart + 1:])[:2], (result.bufferA, result.bufferB))
+
+
+class TestWorkerPieces(unittest.TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(sys.executable, 1)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_worker_streams_the_same_pieces(self):
+        pieces, relayed = [], []
+        result = compute_diff(A, B, {}, stream=PieceStream(pieces.append, 40, 1000, 4000))
+        stream = PieceStream(relayed.append, 40, 1000, 4000)
+        self.assertEqual(self.pool.compute_diff(A, B, {}, stream=stream), result)
+        self.assertEqual(relayed, pieces)
+        self.assertTrue(stream.emitted)
+
+
+if __name__ == '__main__':
+    unittest.main()
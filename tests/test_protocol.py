@@ -0,0 +1,75 @@
+"""Round trips through the wire format of the diff workers.
+
+Run from the package directory with `python -m unittest discover tests`.
+"""
+from __future__ import annotations
+import unittest
+
+from core.diff import compute_diff, compute_intraline_differences
+from core.pieces import DiffPiece
+from core.protocol import (
+    decode_diff_request, decode_diff_result, decode_intraline_request,
+    decode_intraline_result, decode_piece, encode_diff_request, encode_diff_result,
+    encode_intraline_request, encode_intraline_result, encode_piece
+)
+
+
+CASES = {
+    'empty': ('', ''),
+    'equal': ('a\nb\n', 'a\nb\n'),
+    'insert only': ('a\nb\nc', 'a\nx\nb\nc'),
+    'delete only': ('a\nx\nb\nc', 'a\nb\nc'),
+    'replace': ('a\nb\nc\n', 'a\nB\nc\n'),
+    'moved': ('1\n2\n3\n4\nx\n', 'x\n1\n2\n3\n4\n'),
+    'from nothing': ('', 'a\nb\n'),
+}
+
+
+class TestDiffResult(unittest.TestCase):
+    def test_round_trip(self):
+        for name, (a, b) in CASES.items():
+            for options in ({}, {'diff_algorithm': 'ndiff'}):
+                with self.subTest(name, **options):
+                    result = compute_diff(a, b, options)
+                    self.assertEqual(decode_diff_result(encode_diff_result(result)), result)
+
+    def test_degraded_round_trip(self):
+        result = compute_diff('a\n', 'b\n', {})._replace(degraded=('why', 'not'))
+        self.assertEqual(decode_diff_result(encode_diff_result(result)), result)
+
+    def test_request_round_trip(self):
+        options = {'ignore_case': True}
+        payload = encode_diff_request('a\n', 'b\n', options)
+        self.assertEqual(decode_diff_request(payload), ('a\n', 'b\n', options, None))
+        payload = encode_diff_request('a\n', 'b\n', options, (60, 100, 1000))
+        self.assertEqual(
+            decode_diff_request(payload), ('a\n', 'b\n', options, (60, 100, 1000))
+        )
+
+    def test_piece_round_trip(self):
+        for piece in (
+            None,
+            DiffPiece('', '', [], [], [], []),
+            DiffPiece('a\n\n', 'b\nc\n', [(0, 1)], [(0, 3)], [], [(4, 5)]),
+        ):
+            with self.subTest(piece):
+                self.assertEqual(decode_piece(encode_piece(piece)), piece)
+
+
+class TestIntraline(unittest.TestCase):
+    def test_round_trip(self):
+        for name, (a, b) in CASES.items():
+            with self.subTest(name):
+                changes = compute_diff(a, b, {}).found_intraline_changes
+                self.assertEqual(
+                    decode_intraline_request(encode_intraline_request(changes, {})),
+                    (changes, {})
+                )
+                result = compute_intraline_differences(changes, {})
+                self.assertEqual(
+                    decode_intraline_result(encode_intraline_result(result)), result
+                )
+
+
+if __name__ == '__main__':
+    unittest.main()